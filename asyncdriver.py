@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+""" asyncio transport for serial ports (POSIX, selector event loop).
+
+The file descriptor of a pooled serial handle is switched to non-blocking mode
+and registered with the event loop, so one process serves many ports without
+a thread per port:
+
+    driver = AsyncNmeaDriver(settings)
+    await driver.open()
+    await driver.send(b'$HCHDT,123.4,T*22\\r\\n')
+    async for sentence in driver:
+        ...
+"""
+
+import asyncio
+import logging
+import os
+
+import serial
+
+import ioserial
+from framing import NMEAFramer
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncNmeaDriver(object):
+    """ Non-blocking NMEA driver with write-queue backpressure """
+
+    def __init__(self, settings: dict, framer=None, high_water: int = 1 << 16,
+                 low_water: int = 1 << 14, max_sentences: int = 1024) -> None:
+        self.settings = settings
+        self.framer = framer or NMEAFramer()
+        self.high_water = high_water
+        self.low_water = low_water
+
+        self._fd = None
+        self._loop = None
+        self._out = bytearray()
+        self._drain = None
+        self._reading = False
+        self._sentences = asyncio.Queue(max_sentences)
+        self._error = None
+
+        # statistics
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.discarded = 0  # queued bytes still unwritten at close or failure
+
+    @property
+    def queued(self) -> int:
+        """ Bytes waiting in the write queue """
+        return len(self._out)
+
+    async def open(self) -> None:
+        """ Lease a pooled handle, it stays open until close() """
+        self._loop = asyncio.get_running_loop()
+        handle = ioserial.pool.acquire(self.settings)
+        try:
+            self._fd = handle.fileno()
+            os.set_blocking(self._fd, False)
+        except OSError:
+            self._fd = None
+            ioserial.pool.invalidate(self.settings)
+            raise
+        self._error = None
+        self._resume_reading()
+
+    def close(self) -> None:
+        """ Write what the port takes at once, the rest of the queue is counted as discarded """
+        if self._fd is not None and self._flush_out():
+            self._shutdown()
+            ioserial.pool.release(self.settings)
+
+    def _shutdown(self) -> None:
+        self._pause_reading()
+        self._loop.remove_writer(self._fd)
+        self._fd = None
+        if self._out:
+            self.discarded += len(self._out)
+            logger.warning("%s: %d queued bytes discarded", self.settings['port'], len(self._out))
+            self._out.clear()
+        self._wake_drain()
+        if not self._sentences.full():
+            self._sentences.put_nowait(None)  # ends iteration
+
+    async def send(self, message) -> int:
+        """ Queue bytes for writing, waits while the queue is above the high-water mark """
+        if self._error:
+            raise self._error
+        if self._fd is None:
+            raise serial.PortNotOpenError()
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        size = len(message)
+        if not self._out:
+            try:
+                written = os.write(self._fd, message)
+            except BlockingIOError:
+                written = 0
+            self.bytes_out += written
+            message = memoryview(message)[written:]
+            if not message:
+                return size
+            self._loop.add_writer(self._fd, self._on_writable)
+        self._out += message
+        if len(self._out) > self.high_water:
+            await self.drain()
+        return size
+
+    async def drain(self) -> None:
+        """ Wait until the write queue is below the low-water mark """
+        while self._fd is not None and len(self._out) > self.low_water:
+            if self._drain is None:
+                self._drain = self._loop.create_future()
+            await self._drain
+        if self._error:
+            raise self._error
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        sentence = await self._sentences.get()
+        if not self._reading and self._fd is not None:
+            # sentences left in the framer go first, then the port again
+            if self._deliver():
+                self._resume_reading()
+        if sentence is None:
+            raise StopAsyncIteration
+        return sentence
+
+    def _flush_out(self) -> bool:
+        """ Write as much of the queue as the port takes, False after an error """
+        try:
+            written = os.write(self._fd, self._out) if self._out else 0
+        except BlockingIOError:
+            return True
+        except OSError as e:
+            self._fail(e)
+            return False
+        del self._out[:written]
+        self.bytes_out += written
+        return True
+
+    def _on_writable(self) -> None:
+        if not self._flush_out():
+            return
+        if not self._out:
+            self._loop.remove_writer(self._fd)
+        if len(self._out) <= self.low_water:
+            self._wake_drain()
+
+    def _on_readable(self) -> None:
+        try:
+            count = self.framer.readfrom_fd(self._fd)
+        except (OSError, EOFError) as e:
+            self._fail(e)
+            return
+        self.bytes_in += count
+        if not self._deliver():
+            self._pause_reading()  # backpressure, resumed by the consumer
+
+    def _deliver(self) -> bool:
+        """ Move framed sentences to the queue, False if it filled up """
+        for sentence in self.framer:
+            # slices die with the next read, the consumer gets its own copy
+            self._sentences.put_nowait(bytes(sentence))
+            if self._sentences.full():
+                return False
+        return True
+
+    def _resume_reading(self) -> None:
+        self._loop.add_reader(self._fd, self._on_readable)
+        self._reading = True
+
+    def _pause_reading(self) -> None:
+        self._loop.remove_reader(self._fd)
+        self._reading = False
+
+    def _wake_drain(self) -> None:
+        if self._drain is not None and not self._drain.done():
+            self._drain.set_result(None)
+        self._drain = None
+
+    def _fail(self, error: Exception) -> None:
+        self._error = error
+        self._shutdown()
+        ioserial.pool.invalidate(self.settings)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+""" Benchmarks of the encode -> checksum -> write path and of frame decoding.
+
+Every benchmark runs best-of-`repeat` with timeit and reports one number.
+Results are written as JSON and can be compared against an earlier run;
+the exit status is 1 when a result is worse than the baseline by more than
+the tolerance:
+
+    python bench.py --save baseline.json
+    python bench.py --baseline baseline.json --tolerance 0.15 --save current.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import timeit
+
+import ioserial
+import virtualport
+from checksum import checksum, checksums
+from engine import default_params
+from framing import NMEAFramer
+from protocols import HMRDecoder, compile_encoder, message_types
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def result(value: float, unit: str, higher_is_better: bool = True) -> dict:
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def best_time(func, repeat: int) -> float:
+    """ Seconds per call of func, best of `repeat` auto-ranged runs """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+@benchmark('encode')
+def bench_encode(repeat: int) -> dict:
+    """ Message class (to_bytes, formats its input in place) against the compiled encoder """
+    results = {}
+    for name, (message_cls, _) in message_types.items():
+        params = default_params(name)
+        encoder = compile_encoder(name)
+        for label, func in (('class', lambda: message_cls(dict(params)).to_bytes()),
+                            ('compiled', lambda: encoder.encode(params))):
+            seconds = best_time(func, repeat)
+            results['{}.{}.rate'.format(name, label)] = result(1 / seconds, 'sentences/s')
+            results['{}.{}.time'.format(name, label)] = result(seconds * 1e9, 'ns/sentence', False)
+    return results
+
+
+@benchmark('checksum')
+def bench_checksum(repeat: int) -> dict:
+    sentence = compile_encoder('compass').encode(default_params('compass'))[1:-5]
+    blob = bytes(range(256)) * 4096
+    payloads = [sentence] * 1000
+    return {
+        'sentence': result(len(sentence) / best_time(lambda: checksum(sentence), repeat) / 1e6, 'MB/s'),
+        'blob': result(len(blob) / best_time(lambda: checksum(blob), repeat) / 1e6, 'MB/s'),
+        'batch': result(len(sentence) * len(payloads) / best_time(lambda: checksums(payloads), repeat) / 1e6,
+                        'MB/s'),
+    }
+
+
+def _decode_rate(framer, stream: bytes, repeat: int) -> float:
+    view = memoryview(stream)
+
+    def decode():
+        framer.reset()
+        pos = 0
+        while pos < len(view):
+            pos += framer.feed(view[pos:])
+            for _ in framer:
+                pass
+
+    return len(stream) / best_time(decode, repeat)
+
+
+@benchmark('decode')
+def bench_decode(repeat: int) -> dict:
+    results = {}
+    for name, framer in (('compass', NMEAFramer()), ('compass.verify', NMEAFramer(verify=True)),
+                         ('sensor', HMRDecoder())):
+        frame = compile_encoder(name.split('.')[0]).encode(default_params(name.split('.')[0]))
+        stream = frame * ((1 << 20) // len(frame))
+        rate = _decode_rate(framer, stream, repeat)
+        results[name + '.throughput'] = result(rate / 1e6, 'MB/s')
+        results[name + '.rate'] = result(rate / len(frame), 'frames/s')
+    return results
+
+
+@benchmark('latency')
+def bench_latency(repeat: int, count: int = 500) -> dict:
+    """ Send one sentence through a pty loopback and wait for it to come back """
+    if sys.platform == 'win32':
+        return {}
+    settings = {'port': virtualport.PTY, 'baudrate': 115200}
+    driver = ioserial.NmeaDriver()
+    driver.open(settings)
+    received = driver.recieve(NMEAFramer())
+    sentence = compile_encoder('compass').encode(default_params('compass'))
+    samples = []
+    try:
+        for _ in range(count):
+            started = time.perf_counter_ns()
+            driver.send(sentence)
+            next(received)
+            samples.append(time.perf_counter_ns() - started)
+    finally:
+        driver.stop()
+        received.close()
+        driver.close()
+        ioserial.pool.invalidate(settings)
+    samples.sort()
+    return {
+        'median': result(statistics.median(samples) / 1e3, 'us', False),
+        'p99': result(samples[int(len(samples) * 0.99)] / 1e3, 'us', False),
+    }
+
+
+def run(names: list, repeat: int) -> dict:
+    results = {}
+    for name in names:
+        for key, value in BENCHMARKS[name](repeat).items():
+            results[name + '.' + key] = value
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """ (name, baseline, current, change) of results worse than tolerance """
+    regressions = []
+    for name, old in baseline['results'].items():
+        new = current['results'].get(name)
+        if new is None or not old['value']:
+            continue
+        change = new['value'] / old['value'] - 1
+        worse = -change if old['higher_is_better'] else change
+        if worse > tolerance:
+            regressions.append((name, old['value'], new['value'], change))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks of encoding, checksums, decoding and latency")
+    parser.add_argument('names', nargs='*', metavar='NAME',
+                        help="benchmarks to run: " + ", ".join(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', help="write results to this JSON file")
+    parser.add_argument('--baseline', help="compare against results saved earlier")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="allowed slowdown, 0.1 is 10%%")
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmark: " + ", ".join(sorted(unknown)))
+
+    current = run(args.names or list(BENCHMARKS), args.repeat)
+    for name, value in current['results'].items():
+        print("{:40s} {:>14.1f} {}".format(name, value['value'], value['unit']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        for name, old, new, change in regressions:
+            print("REGRESSION {:40s} {:.1f} -> {:.1f} ({:+.0%})".format(name, old, new, change))
+        if regressions:
+            return 1
+        print("no regressions against {}".format(args.baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+""" NMEA-0183 checksum (XOR of all bytes between `$` and `*`) """
+
+import operator
+from functools import reduce
+
+# below this size a plain C-level reduce beats building wide integers
+_FOLD_THRESHOLD = 64
+
+
+def _fold(value: int, size: int) -> int:
+    """ XOR the upper half of a `size`-byte integer onto the lower half until one byte is left """
+    while size > 1:
+        half = (size + 1) >> 1
+        shift = half << 3
+        value = (value >> shift) ^ (value & ((1 << shift) - 1))
+        size = half
+    return value
+
+
+def checksum(data) -> int:
+    """ Checksum of str, bytes, bytearray or memoryview payload """
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    if len(data) < _FOLD_THRESHOLD:
+        return reduce(operator.xor, data, 0)
+    # the wide integer is XORed word by word inside CPython
+    return _fold(int.from_bytes(data, 'little'), len(data))
+
+
+def checksums(payloads) -> list:
+    """ Checksums of many payloads in one pass.
+
+    Payloads are padded with zeros to a common power-of-two lane width and
+    concatenated into one wide integer. Each shift-XOR halves every lane at once;
+    the low byte of a lane only ever mixes with bytes of the same lane, so no
+    masking is needed and the result is every lane's first byte.
+    """
+    payloads = [p.encode('latin-1') if isinstance(p, str) else p for p in payloads]
+    if not payloads:
+        return []
+
+    width = 1
+    while width < max(map(len, payloads)):
+        width <<= 1
+    value = int.from_bytes(b''.join([bytes(p).ljust(width, b'\0') for p in payloads]), 'little')
+
+    size = width
+    while size > 1:
+        size >>= 1
+        value ^= value >> (size << 3)
+
+    return list(value.to_bytes(width * len(payloads), 'little')[::width])
+
+
+def verify(sentence) -> bool:
+    """ Check a complete `$...*hh[\\r\\n]` sentence """
+    sentence = memoryview(sentence.encode('latin-1') if isinstance(sentence, str) else sentence)
+    end = len(sentence)
+    while end and sentence[end - 1] in (10, 13):
+        end -= 1
+    if end < 4 or sentence[end - 3] != 42:  # '*'
+        return False
+    try:
+        expected = int(bytes(sentence[end - 2:end]), 16)
+    except ValueError:
+        return False
+    return checksum(sentence[1:end - 3]) == expected
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+""" Columnar decode of captures into NumPy structured arrays, for post-analysis.
+
+A log is read in large blocks. Sentences are located with vectorised searches
+(`$` ... `*hh\\r\\n` for NMEA, the SOP preamble for HMR), fields are cut at
+the commas and numbers parsed by digit arithmetic over whole columns, so no
+Python code runs per sentence. The result is one structured array per sentence
+type with `timestamp` (monotonic ns interpolated from the capture index, -1 for
+plain logs), `position` (byte offset in the log) and the numeric fields of the
+matching nmea.py sentence class:
+
+    arrays = decode_capture('captures', 'compass-20261018-120000')
+    arrays['HDT']['heading'].mean()
+
+    python columnar.py captures compass-20261018-120000 --out run.npz
+"""
+
+import argparse
+import logging
+import os
+
+import numpy as np
+
+import nmea
+from batch import HMR_FRAME
+from framing import NMEAFramer
+from protocols import DEG_PER_KANG, TESLA_PER_GAUSS, HMRDecoder, HMRDorient
+from recorder import CaptureReader, NMEA_MARKER, HMR_MARKER
+
+logger = logging.getLogger(__name__)
+
+MAX_LENGTH = NMEAFramer.MAX_LENGTH
+MAX_FIELD = 16  # longer numeric fields decode as NaN
+
+_POW10F = 10.0 ** np.arange(MAX_FIELD + 1)
+
+_HEX = np.full(256, 255, dtype=np.uint8)
+for _i, _c in enumerate(b'0123456789ABCDEF'):
+    _HEX[_c] = _i
+for _i, _c in enumerate(b'abcdef'):
+    _HEX[_c] = 10 + _i
+
+
+def _columns(cls) -> list:
+    """ (name, field index, kind) of the numeric fields of an nmea.py sentence class """
+    columns = []
+    for name in cls.FIELDS:
+        field = cls.__dict__.get(name)
+        if isinstance(field, nmea.Coordinate):
+            columns.append((name, field.index, field.width))
+        elif isinstance(field, nmea.Field) and field.convert in (nmea._float, nmea._int):
+            columns.append((name, field.index, 'number'))
+        elif isinstance(field, nmea.Field) and field.convert is nmea._time:
+            columns.append((name, field.index, 'time'))
+    return columns
+
+
+# sentence type (b'HDT') -> (3-byte key, columns, dtype)
+LAYOUTS = {}
+for _formatter, _cls in nmea._sentences.items():
+    if len(_formatter) == 3:
+        _cols = _columns(_cls)
+        LAYOUTS[_formatter.decode()] = (
+            (_formatter[0] << 16) | (_formatter[1] << 8) | _formatter[2],
+            _cols,
+            np.dtype([('timestamp', '<i8'), ('position', '<i8'), ('talker', 'S2')] +
+                     [(name, '<f8') for name, _, _ in _cols]))
+
+HMR_COLUMNS = np.dtype([('timestamp', '<i8'), ('position', '<i8')] +
+                       [(name, '<f8') for name in HMRDorient.FIELDS])
+
+
+def parse_numbers(buf: np.ndarray, start: np.ndarray, stop: np.ndarray) -> np.ndarray:
+    """ Decimal numbers in buf[start:stop] as float64, NaN for empty or malformed fields """
+    width = stop - start
+    value = np.full(len(start), np.nan)
+    if not len(start):
+        return value
+
+    sign = np.isin(buf[np.minimum(start, len(buf) - 1)], (ord('-'), ord('+'))) & (width > 0)
+    start = start + sign
+    width = width - sign
+    # Horner's scheme one column at a time: the mantissa of all digits, divided by
+    # 10**(digits after the dot) at the end, so the result is correctly rounded
+    last = len(buf) - 1
+    mantissa = np.zeros(len(start), dtype=np.int64)
+    decimals = np.zeros(len(start), dtype=np.int64)
+    seen_dot = np.zeros(len(start), dtype=bool)
+    bad = (width <= 0) | (width > MAX_FIELD)
+    for column in range(int(min(width.max(), MAX_FIELD))):
+        inside = column < width
+        chars = buf[np.minimum(start + column, last)]
+        digits = chars - np.uint8(ord('0'))  # wraps around for non-digits
+        digit = inside & (digits < 10)
+        dot = inside & (chars == ord('.'))
+        mantissa = np.where(digit, mantissa * 10 + digits, mantissa)
+        decimals += digit & seen_dot
+        bad |= (dot & seen_dot) | (inside & ~digit & ~dot)
+        seen_dot |= dot
+
+    result = mantissa / _POW10F[decimals]
+    negative = sign & (buf[np.minimum(start - 1, last)] == ord('-'))
+    result[negative] = -result[negative]
+    value[~bad] = result[~bad]
+    return value
+
+
+class _Block(object):
+    """ Sentence positions in one block of NMEA text """
+
+    def __init__(self, buf: np.ndarray, verify: bool) -> None:
+        self.buf = buf
+        dollars = np.flatnonzero(buf == ord('$'))
+        newlines = np.flatnonzero(buf == ord('\n'))
+        # everything up to the last newline is decoded now, the rest waits for the next block
+        self.consumed = int(newlines[-1]) + 1 if len(newlines) else 0
+
+        following = np.searchsorted(newlines, dollars)
+        complete = following < len(newlines)
+        start = dollars[complete]
+        end = newlines[following[complete]]
+        next_start = np.append(dollars[1:], len(buf))[complete]
+
+        ok = (next_start > end) & (end - start < MAX_LENGTH) & (end - start >= 10)
+        start, end = start[ok], end[ok]
+        ok = (buf[end - 1] == ord('\r')) & (buf[end - 4] == ord('*')) & (buf[start + 6] == ord(','))
+        start, end = start[ok], end[ok]
+        if verify and len(start):
+            star = end - 4
+            bounds = np.column_stack([start + 1, star]).ravel()
+            computed = np.bitwise_xor.reduceat(buf, bounds)[::2]
+            expected = (_HEX[buf[star + 1]].astype(np.uint16) << 4) | _HEX[buf[star + 2]]
+            ok = computed == expected
+            start, end = start[ok], end[ok]
+
+        self.start, self.end = start, end
+        self.star = end - 4
+        self.key = (buf[start + 3].astype(np.uint32) << 16) | (buf[start + 4].astype(np.uint32) << 8) | buf[start + 5]
+        self.commas = np.flatnonzero(buf == ord(','))
+
+    def fields(self, first: np.ndarray, star: np.ndarray, index: int) -> tuple:
+        """ (start, stop) of data field `index` of sentences whose address ends at commas[first] """
+        last = len(self.commas) - 1
+        opening = self.commas[np.minimum(first + index, last)]
+        closing = self.commas[np.minimum(first + index + 1, last)]
+        present = (first + index <= last) & (opening < star)
+        closing = np.where((first + index + 1 <= last) & (closing < star), closing, star)
+        start = np.where(present, opening + 1, star)
+        return start, np.where(present, closing, star)
+
+
+class ColumnarDecoder(object):
+    """ Collects decoded blocks of one log into per-type column chunks """
+
+    def __init__(self, marker: bytes = NMEA_MARKER, types=None, verify: bool = True) -> None:
+        self.marker = marker
+        self.types = list(types or LAYOUTS)
+        self.verify = verify
+        self._chunks = {}
+
+        # statistics
+        self.bytes = 0
+        self.sentences = 0
+
+    def decode_file(self, path: str, block_size: int = 4 << 20, index=None) -> None:
+        """ Decode a log; index is ([offsets], [timestamps]) of its capture index, if any """
+        keep = MAX_LENGTH if self.marker == NMEA_MARKER else HMRDorient.FRAME.size
+        buffer = np.empty(block_size + keep, dtype=np.uint8)
+        pending, base = 0, 0  # bytes carried over from the previous block, their offset in the log
+        with open(path, 'rb', buffering=0) as f:
+            while True:
+                count = f.readinto(memoryview(buffer)[pending:])
+                if not count:
+                    break
+                buf = buffer[:pending + count]
+                consumed = self._decode(buf, base, index)
+                self.bytes += consumed
+                # carry the unfinished tail, a frame cannot be longer than `keep`
+                tail = max(consumed, len(buf) - keep)
+                pending = len(buf) - tail
+                buffer[:pending] = buf[tail:]
+                base += tail
+
+    def result(self) -> dict:
+        """ {type: structured array}, 'HMR' for HMR frames """
+        return {name: np.concatenate(chunks) for name, chunks in self._chunks.items()}
+
+    def _decode(self, buf: np.ndarray, base: int, index) -> int:
+        if self.marker == NMEA_MARKER:
+            return self._decode_nmea(buf, base, index)
+        return self._decode_hmr(buf, base, index)
+
+    def _decode_nmea(self, buf: np.ndarray, base: int, index) -> int:
+        block = _Block(buf, self.verify)
+        for name in self.types:
+            key, columns, dtype = LAYOUTS[name]
+            select = block.key == key
+            count = int(select.sum())
+            if not count:
+                continue
+            out = np.empty(count, dtype=dtype)
+            start = block.start[select]
+            out['position'] = start + base
+            out['timestamp'] = _timestamps(out['position'], index)
+            out['talker'] = buf[start[:, None] + np.arange(1, 3)].view('S2').ravel()
+            first, star = np.searchsorted(block.commas, start), block.star[select]
+            for column, field, kind in columns:
+                field_start, stop = block.fields(first, star, field)
+                values = parse_numbers(buf, field_start, stop)
+                if kind == 'time':
+                    # hhmmss.ss -> seconds of the day
+                    values = values // 10000 * 3600 + values // 100 % 100 * 60 + values % 100
+                elif kind != 'number':
+                    # (d)ddmm.mmmm plus hemisphere -> signed degrees
+                    degrees = values // 100
+                    values = degrees + (values - degrees * 100) / 60.0
+                    hemisphere_start, _ = block.fields(first, star, field + 1)
+                    south_west = np.isin(buf[np.minimum(hemisphere_start, len(buf) - 1)], (ord('S'), ord('W')))
+                    values = np.where(south_west, -values, values)
+                out[column] = values
+            self._chunks.setdefault(name, []).append(out)
+            self.sentences += count
+        return block.consumed
+
+    def _decode_hmr(self, buf: np.ndarray, base: int, index) -> int:
+        size = HMRDorient.FRAME.size
+        preamble = HMRDecoder.PREAMBLE
+        if len(buf) < size:
+            return 0
+        candidates = np.flatnonzero((buf[:-2] == preamble[0]) & (buf[1:-1] == preamble[1]) & (buf[2:] == preamble[2]))
+        candidates = candidates[candidates + size <= len(buf)]
+        candidates = candidates[(buf[candidates + 3] == HMRDorient.MID[0]) & (buf[candidates + 4] == HMRDorient.LENGTH[0])]
+        if len(candidates) > 1 and (np.diff(candidates) < size).any():
+            # a preamble inside the payload of a real frame: keep frames greedily, like HMRDecoder
+            kept, free = [], 0
+            for position in candidates.tolist():
+                if position >= free:
+                    kept.append(position)
+                    free = position + size
+            candidates = np.array(kept, dtype=np.int64)
+
+        consumed = int(candidates[-1]) + size if len(candidates) else max(len(buf) - size + 1, 0)
+        if not len(candidates):
+            return consumed
+        frames = buf[candidates[:, None] + np.arange(size)].view(HMR_FRAME).ravel()
+        out = np.empty(len(frames), dtype=HMR_COLUMNS)
+        out['position'] = candidates + base
+        out['timestamp'] = _timestamps(out['position'], index)
+        for name in ('roll', 'pitch', 'heading'):
+            out[name] = frames[name] * DEG_PER_KANG
+        for name in ('magc', 'magb', 'magz'):
+            out[name] = frames[name] * TESLA_PER_GAUSS
+        self._chunks.setdefault('HMR', []).append(out)
+        self.sentences += len(out)
+        return consumed
+
+
+def _timestamps(offsets: np.ndarray, index) -> np.ndarray:
+    """ Timestamps interpolated by byte position between index records, -1 without an index """
+    if index is None:
+        return np.full(len(offsets), -1, dtype=np.int64)
+    positions, timestamps = index
+    return np.interp(offsets, positions, timestamps).astype(np.int64)
+
+
+def decode_file(path: str, marker: bytes = NMEA_MARKER, types=None, verify: bool = True) -> dict:
+    """ Decode a plain log (raw NMEA text or HMR binary) """
+    decoder = ColumnarDecoder(marker, types, verify)
+    decoder.decode_file(path)
+    return decoder.result()
+
+
+def decode_capture(directory: str, name: str = 'capture', marker: bytes = NMEA_MARKER,
+                   types=None, verify: bool = True) -> dict:
+    """ Decode all segments of a capture written by recorder.CaptureWriter """
+    reader = CaptureReader(directory, name)
+    decoder = ColumnarDecoder(marker, types, verify)
+    try:
+        for path, column, _ in reader.segments:
+            records = [column.record(i) for i in range(len(column))]
+            index = (np.array([offset for _, offset, _ in records], dtype=np.float64),
+                     np.array([timestamp for timestamp, _, _ in records], dtype=np.float64))
+            decoder.decode_file(path, index=index)
+    finally:
+        reader.close()
+    return decoder.result()
+
+
+def main(argv=None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)-5.5s]  %(message)s")
+    parser = argparse.ArgumentParser(description="Decode a capture into NumPy arrays (.npz)")
+    parser.add_argument('path', help="capture directory, or a plain log file")
+    parser.add_argument('name', nargs='?', default='capture', help="capture name")
+    parser.add_argument('--hmr', action='store_true', help="HMR binary frames instead of NMEA text")
+    parser.add_argument('--type', dest='types', action='append', choices=sorted(LAYOUTS),
+                        help="sentence types to keep, all by default")
+    parser.add_argument('--no-verify', dest='verify', action='store_false', help="keep sentences with a bad checksum")
+    parser.add_argument('--out', required=True, help="output .npz file")
+    args = parser.parse_args(argv)
+
+    marker = HMR_MARKER if args.hmr else NMEA_MARKER
+    if os.path.isdir(args.path):
+        arrays = decode_capture(args.path, args.name, marker, args.types, args.verify)
+    else:
+        arrays = decode_file(args.path, marker, args.types, args.verify)
+    np.savez(args.out, **arrays)
+    for name, array in arrays.items():
+        logger.info("%s: %d rows", name, len(array))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+""" Headless transmit engine.
+
+Runs the encode -> send loop in its own thread on absolute deadlines, so the
+output rate does not depend on the Qt event loop. The GUI only pushes parameter
+updates and reads statistics back. Without PyQt5 it works as a soak-test CLI:
+
+    python engine.py --port /dev/ttyUSB0 --baudrate 115200 \
+        --stream compass:10 --stream sonar:1 --stream sensor:20 compass.heading=123.4
+
+Repeating --port (optionally as PORT:BAUDRATE) fans the frames out to all ports.
+A port udp://HOST:PORT or tcp://HOST:PORT sends over the network instead
+(see netsink), --baudrate then only sets the pace of full-line streams.
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+
+import ioserial
+import netsink
+import pacing
+from fanout import FanOut
+from message_desc import messages
+from metrics import MetricsServer, registry
+from protocols import compile_encoder
+from scheduler import POLICIES as LAG_POLICIES, SKIP, Stream, StreamScheduler
+
+logger = logging.getLogger(__name__)
+
+_encode_time = registry.histogram('encode', "time to encode one frame")
+_jitter = registry.histogram('timer_jitter', "how late a frame left after its release time")
+_frames = registry.counter('frames_sent_total', "frames handed to the driver")
+
+
+def default_params(name: str) -> dict:
+    """ Initial parameters of a message type, as the option box shows them """
+    params = {}
+    for key, _, items in messages[name]['fields']:
+        params[key] = items[0]
+    return params
+
+
+class TransmitEngine(object):
+    """ Sends the streams of a scheduler from a background thread """
+
+    def __init__(self, driver, scheduler: StreamScheduler) -> None:
+        self.driver = driver
+        self.scheduler = scheduler
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'bytes': 0, 'errors': 0, 'encode_errors': 0, 'last': b''}
+
+    def update(self, name: str, params: dict) -> None:
+        """ Replace parameters of a stream, picked up by its next frame """
+        self.scheduler.update(name, params)
+
+    @property
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        streams = tuple(self.scheduler.streams.values())
+        stats['sent'] = sum(stream.sent for stream in streams)
+        stats['missed'] = sum(stream.missed for stream in streams)
+        stats['load'] = self.scheduler.load()
+        stats['streams'] = {stream.name: {'sent': stream.sent, 'missed': stream.missed, 'errors': stream.errors,
+                                          'jitter': stream.jitter.snapshot()}
+                            for stream in streams}
+        driver = self.driver
+        if isinstance(driver, pacing.PacedWriter):
+            stats['pacing'] = driver.stats
+            driver = driver.driver
+        if isinstance(driver, FanOut):
+            stats['ports'] = driver.stats
+        elif isinstance(driver, (netsink.UdpDriver, netsink.TcpDriver)):
+            stats['network'] = driver.stats
+        return stats
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='transmit', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 1.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        stats, send, scheduler = self._stats, self.driver.send, self.scheduler
+        scheduler.start(time.monotonic_ns())
+        while not self._stop.is_set():
+            release, stream = scheduler.next_due()
+            if stream is None:
+                self._stop.wait(0.1)
+                continue
+
+            # deadlines are absolute, so a late wake-up never shifts the next ones
+            delay = release - time.monotonic_ns()
+            if delay > 0:
+                self._stop.wait(delay / 1e9)
+                continue
+
+            started = time.monotonic_ns()
+            # the timer is judged against the release time, the stream against its nominal
+            # deadline, so frames sent back-to-back by catch-up show how late they really are
+            _jitter.record(started - release)
+            stream.jitter.record(started - stream.deadline)
+            encoding = time.monotonic_ns()
+            try:
+                message = stream.encode()
+            except Exception as e:
+                # bad parameters cost the frame, not the transmit thread
+                stats['encode_errors'] += 1
+                if not stream.errors:
+                    logger.warning("%s: encode failed: %s", stream.name, e)
+                scheduler.failed(stream, time.monotonic_ns())
+                continue
+            _encode_time.record(time.monotonic_ns() - encoding)
+            _frames.inc()
+            try:
+                stats['bytes'] += send(message) or 0
+                stats['last'] = message
+            except OSError as e:
+                stats['errors'] += 1
+                logger.warning("send failed: %s", e)
+            scheduler.sent(stream, len(message), time.monotonic_ns())
+
+
+def jitter_report(scheduler: StreamScheduler) -> dict:
+    """ Jitter histograms of all streams, nanoseconds """
+    return {name: dict(stream.jitter.to_dict(), rate=stream.rate, sent=stream.sent, missed=stream.missed)
+            for name, stream in scheduler.streams.items()}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Headless NMEA/HMR generator")
+    parser.add_argument('--port', dest='ports', action='append', required=True, metavar='PORT[:BAUDRATE]',
+                        help="repeat to fan the same frames out to several ports")
+    parser.add_argument('--baudrate', type=int, default=4800)
+    parser.add_argument('--bytesize', type=int, default=8)
+    parser.add_argument('--parity', default='N')
+    parser.add_argument('--stopbits', type=float, default=1)
+    parser.add_argument('--stream', dest='streams', action='append', metavar='TYPE:RATE',
+                        help="message type and messages per second, rate 0 takes the whole line "
+                             "(" + ", ".join(messages) + ")")
+    parser.add_argument('--policy', choices=pacing.POLICIES,
+                        help="pace writes to the baudrate, with this policy on overload")
+    parser.add_argument('--queue', type=int, default=64, help="paced write queue length")
+    parser.add_argument('--lag', choices=LAG_POLICIES, default=SKIP,
+                        help="what a stream that fell behind does with the frames it missed")
+    parser.add_argument('--duration', type=float, default=0.0, help="seconds, 0 runs until Ctrl+C")
+    parser.add_argument('params', nargs='*', metavar='type.key=value', help="message parameters")
+    return parser
+
+
+def parse_args(argv=None):
+    parser = build_parser()
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help="serve Prometheus metrics on 127.0.0.1 at this port, 0 disables")
+    parser.add_argument('--jitter-report', metavar='PATH', help="write per-stream jitter histograms as JSON at exit")
+    args = parser.parse_args(argv)
+    try:
+        stream_params(args)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+
+def stream_params(args) -> tuple:
+    """ ([(type, rate)], {type: params}) from --stream options and type.key=value arguments.
+
+    Raises ValueError with a usage message for malformed or unknown items.
+    """
+    streams = []
+    for item in args.streams or ['compass:1']:
+        name, _, rate = item.partition(':')
+        if name not in messages:
+            raise ValueError("unknown message type in --stream {}, expected one of: {}".format(
+                item, ", ".join(messages)))
+        try:
+            rate = float(rate)
+        except ValueError:
+            raise ValueError("--stream {} needs TYPE:RATE with a number of messages per second".format(item))
+        if rate < 0:
+            raise ValueError("--stream {}: rate must not be negative".format(item))
+        streams.append((name, rate))
+
+    params = {name: default_params(name) for name, _ in streams}
+    for item in args.params:
+        apply_param(params, item)
+    return streams, params
+
+
+def apply_param(params: dict, item: str) -> str:
+    """ Set one `type.key=value` item in {type: params}, return the type; ValueError if it does not fit """
+    key, sep, value = item.partition('=')
+    name, _, key = key.partition('.')
+    if not sep or not key:
+        raise ValueError("parameter {} is not type.key=value".format(item))
+    if name not in params:
+        raise ValueError("parameter {} is for {}, which has no --stream".format(item, name))
+    if key not in params[name]:
+        raise ValueError("{} has no parameter {}, expected one of: {}".format(
+            name, key, ", ".join(params[name])))
+    try:
+        params[name][key] = _convert(value, params[name][key])
+    except ValueError:
+        raise ValueError("{}.{} must be a number, got {!r}".format(name, key, value))
+    return name
+
+
+def port_settings(args) -> list:
+    settings = []
+    for item in args.ports:
+        port, _, baudrate = item.rpartition(':')
+        if netsink.is_network(item) or not port or not baudrate.isdigit():
+            port, baudrate = item, args.baudrate
+        settings.append({
+            'port': port,
+            'baudrate': int(baudrate),
+            'bytesize': args.bytesize,
+            'parity': args.parity,
+            'stopbits': args.stopbits
+        })
+    return settings
+
+
+def _convert(value: str, default):
+    return type(default)(value) if isinstance(default, (int, float)) else value
+
+
+def main(argv=None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)-5.5s]  %(message)s")
+    args = parse_args(argv)
+
+    ports = port_settings(args)
+    # the slowest port decides what fits on the line
+    settings = min(ports, key=ioserial.line_capacity)
+    scheduler = StreamScheduler(ioserial.line_capacity(settings), args.lag)
+
+    streams, params = stream_params(args)
+    for name, rate in streams:
+        encoder = compile_encoder(name)
+        rate = rate or scheduler.capacity / len(encoder.encode(params[name]))
+        scheduler.add(Stream(name, encoder, rate, params[name]))
+
+    if any(netsink.is_network(port['port']) for port in ports):
+        if len(ports) > 1:
+            raise SystemExit("a network destination cannot be combined with other ports")
+        driver = netsink.open_driver(settings)
+    elif len(ports) > 1:
+        driver = FanOut(ports)
+        driver.start()
+    else:
+        driver = ioserial.NmeaDriver()
+        driver.open(settings)
+    writer = driver
+    if args.policy:
+        writer = pacing.PacedWriter(driver, settings, args.policy, args.queue)
+        writer.start()
+    engine = TransmitEngine(writer, scheduler)
+    engine.start()
+    server = None
+    if args.metrics_port:
+        server = MetricsServer(registry, port=args.metrics_port)
+        server.start()
+    started = time.monotonic()
+    try:
+        while not args.duration or time.monotonic() - started < args.duration:
+            time.sleep(1.0)
+            stats = engine.stats
+            logger.info("sent %d, bytes %d, errors %d, missed %d, load %.0f%%",
+                        stats['sent'], stats['bytes'], stats['errors'], stats['missed'],
+                        stats['load'] * 100)
+            if 'pacing' in stats:
+                logger.info("queue %(queue)d, utilisation %(utilisation).2f, "
+                            "dropped %(dropped)d, coalesced %(coalesced)d", stats['pacing'])
+            for name, port in stats.get('ports', {}).items():
+                logger.info("%s: online %s, frames %d, dropped %d, errors %d", name,
+                            port['online'], port['frames'], port['dropped'], port['errors'])
+            if 'network' in stats:
+                logger.info("network: %s", ", ".join("{} {}".format(k, v) for k, v in stats['network'].items()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.stop()
+        if server:
+            server.stop()
+        if args.jitter_report:
+            with open(args.jitter_report, 'w') as f:
+                json.dump(jitter_report(scheduler), f, indent=2)
+        if writer is not driver:
+            writer.stop()
+        if isinstance(driver, FanOut):
+            driver.stop()
+        else:
+            driver.close()
+        ioserial.pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
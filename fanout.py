@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+""" Fan-out of one generator to several serial ports (POSIX).
+
+A frame is encoded once and the same bytes object is written to every port
+through its non-blocking file descriptor. What a port does not accept at once
+waits in that port's bounded backlog and is flushed by one selector thread.
+A slow or failing port only loses its own frames and is reopened after a pause,
+the other ports keep going.
+"""
+
+import logging
+import os
+import selectors
+import threading
+import time
+
+import ioserial
+
+logger = logging.getLogger(__name__)
+
+
+class PortSink(object):
+    """ One output port of a FanOut """
+
+    def __init__(self, settings: dict, max_pending: int) -> None:
+        self.settings = settings
+        self.name = settings['port']
+        self.max_pending = max_pending
+        self.fd = None
+        self.pending = bytearray()
+        self.retry_at = 0.0
+
+        # statistics
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.errors = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'online': self.fd is not None,
+            'frames': self.frames,
+            'bytes': self.bytes,
+            'pending': len(self.pending),
+            'dropped': self.dropped,
+            'errors': self.errors
+        }
+
+
+class FanOut(object):
+    """ Driver-like `send` that writes every frame to all ports """
+
+    def __init__(self, ports: list, max_pending: int = 1 << 14, retry: float = 2.0) -> None:
+        self.sinks = [PortSink(settings, max_pending) for settings in ports]
+        self.retry = retry
+        self._lock = threading.Lock()
+        self._selector = None
+        self._wakeup = None
+        self._running = False
+        self._thread = None
+
+    @property
+    def stats(self) -> dict:
+        return {sink.name: sink.stats for sink in self.sinks}
+
+    def start(self) -> None:
+        self._selector = selectors.DefaultSelector()
+        self._wakeup = os.pipe()
+        os.set_blocking(self._wakeup[1], False)
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+        for sink in self.sinks:
+            self._open(sink)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='fanout', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 1.0) -> None:
+        self._running = False
+        self._wake()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._lock:
+            for sink in self.sinks:
+                self._close(sink)
+        self._selector.close()
+        for fd in self._wakeup:
+            os.close(fd)
+
+    def send(self, frame) -> int:
+        """ Write frame to every online port, never blocks on a slow one """
+        wake = False
+        with self._lock:
+            for sink in self.sinks:
+                if sink.fd is None:
+                    sink.dropped += 1
+                    continue
+                if sink.pending:
+                    if len(sink.pending) + len(frame) > sink.max_pending:
+                        sink.dropped += 1
+                    else:
+                        sink.pending += frame
+                        sink.frames += 1
+                    continue
+                try:
+                    written = os.write(sink.fd, frame)
+                except BlockingIOError:
+                    written = 0
+                except OSError as e:
+                    self._fail(sink, e)
+                    continue
+                sink.frames += 1
+                sink.bytes += written
+                if written < len(frame):
+                    sink.pending += memoryview(frame)[written:]
+                    wake = True
+        if wake:
+            self._wake()
+        return len(frame)
+
+    def _run(self) -> None:
+        while self._running:
+            with self._lock:
+                now = time.monotonic()
+                for sink in self.sinks:
+                    if sink.fd is None and now >= sink.retry_at:
+                        self._open(sink)
+                    elif sink.fd is not None:
+                        events = selectors.EVENT_WRITE if sink.pending else 0
+                        self._watch(sink, events)
+
+            for key, _ in self._selector.select(timeout=self.retry / 2):
+                if key.fd == self._wakeup[0]:
+                    try:
+                        os.read(self._wakeup[0], 512)
+                    except BlockingIOError:
+                        pass
+                    continue
+                with self._lock:
+                    self._flush(key.data)
+
+    def _flush(self, sink: PortSink) -> None:
+        if sink.fd is None or not sink.pending:
+            return
+        try:
+            written = os.write(sink.fd, sink.pending)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._fail(sink, e)
+            return
+        del sink.pending[:written]
+        sink.bytes += written
+
+    def _watch(self, sink: PortSink, events: int) -> None:
+        registered = sink.fd in self._selector.get_map()
+        if events and not registered:
+            self._selector.register(sink.fd, events, sink)
+        elif not events and registered:
+            self._selector.unregister(sink.fd)
+
+    def _open(self, sink: PortSink) -> None:
+        """ Lease the pooled handle until _close or _fail, the reaper leaves leased fds alone """
+        leased = False
+        try:
+            handle = ioserial.pool.acquire(sink.settings)
+            leased = True
+            sink.fd = handle.fileno()
+            os.set_blocking(sink.fd, False)
+        except OSError as e:
+            if leased:
+                ioserial.pool.invalidate(sink.settings)
+            sink.fd = None
+            sink.errors += 1
+            sink.retry_at = time.monotonic() + self.retry
+            logger.warning("%s: open failed: %s", sink.name, e)
+
+    def _close(self, sink: PortSink) -> None:
+        if sink.fd is not None:
+            self._watch(sink, 0)
+            sink.fd = None
+            ioserial.pool.release(sink.settings)
+        sink.pending.clear()
+
+    def _fail(self, sink: PortSink, error: Exception) -> None:
+        logger.warning("%s: write failed: %s", sink.name, error)
+        sink.errors += 1
+        self._watch(sink, 0)
+        sink.fd = None
+        sink.pending.clear()
+        sink.retry_at = time.monotonic() + self.retry
+        ioserial.pool.invalidate(sink.settings)
+
+    def _wake(self) -> None:
+        try:
+            os.write(self._wakeup[1], b'\0')
+        except (BlockingIOError, OSError):
+            pass
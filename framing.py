@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+""" Incremental framers for the receive direction """
+
+import os
+
+from checksum import checksum
+
+
+class Framer(object):
+    """ Fixed reusable receive buffer shared by the framers """
+
+    def __init__(self, size: int = 1 << 16) -> None:
+        self._size = size
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    @property
+    def free(self) -> int:
+        return self._size - len(self)
+
+    def feed(self, data) -> int:
+        """ Copy as much of data as fits into the buffer, return number of bytes taken """
+        self._compact()
+        count = min(len(data), self._size - self._end)
+        self._view[self._end:self._end + count] = data[:count]
+        self._end += count
+        return count
+
+    def readfrom(self, port) -> int:
+        """ Read whatever the port has available (at least one byte, honouring its timeout) """
+        self._compact()
+        want = max(1, min(port.in_waiting, self._size - self._end))
+        count = port.readinto(self._view[self._end:self._end + want]) or 0
+        self._end += count
+        return count
+
+    def readfrom_fd(self, fd: int) -> int:
+        """ Read what a non-blocking file descriptor has, 0 if nothing is available """
+        self._compact()
+        try:
+            count = os.readv(fd, [self._view[self._end:]])
+        except BlockingIOError:
+            return 0
+        if not count and self._end < self._size:
+            raise EOFError("port closed")
+        self._end += count
+        return count
+
+    def reset(self) -> None:
+        self._start = self._end = 0
+
+    def _compact(self) -> None:
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end - self._start < self._start or self._end == self._size:
+            count = self._end - self._start
+            self._buffer[:count] = self._buffer[self._start:self._end]
+            self._start, self._end = 0, count
+
+
+class NMEAFramer(Framer):
+    """ Splits a byte stream into complete `$...*hh\\r\\n` sentences.
+
+    Bytes are collected in a fixed reusable buffer and sentences are yielded as
+    memoryview slices of it, so a slice is only valid until the next feed/readfrom.
+    Garbage between sentences, overlong frames and frames cut by a new `$` are skipped,
+    with `verify` sentences with a wrong checksum are dropped too.
+    """
+    START = ord('$')
+    STAR = ord('*')
+    CR = ord('\r')
+    LF = b'\n'
+    MAX_LENGTH = 82  # NMEA-0183 limit including `$` and `\r\n`
+
+    def __init__(self, size: int = 1 << 16, max_length: int = MAX_LENGTH, verify: bool = False) -> None:
+        if size < 2 * max_length:
+            raise ValueError("buffer size must be at least twice max_length")
+        super().__init__(size)
+        self.max_length = max_length
+        self.verify = verify
+
+        # statistics
+        self.sentences = 0
+        self.errors = 0
+        self.garbage = 0
+        self.checksum_errors = 0
+
+    def __iter__(self):
+        buf, view = self._buffer, self._view
+        pos, end = self._start, self._end
+        while True:
+            sop = buf.find(self.START, pos, end)
+            if sop < 0:
+                self.garbage += end - pos
+                pos = end
+                break
+            self.garbage += sop - pos
+
+            eol = buf.find(self.LF, sop, min(end, sop + self.max_length))
+            if eol < 0:
+                if end - sop < self.max_length:
+                    pos = sop  # partial frame, wait for more bytes
+                    break
+                self.errors += 1  # overlong, resync after this `$`
+                pos = sop + 1
+                continue
+
+            restart = buf.find(self.START, sop + 1, eol)
+            if restart >= 0:
+                self.errors += 1  # frame cut by a new sentence
+                pos = restart
+                continue
+
+            pos = eol + 1
+            if eol - sop < 5 or buf[eol - 1] != self.CR or buf[eol - 4] != self.STAR:
+                self.errors += 1
+                continue
+
+            if self.verify and not self._checksum_ok(sop, eol):
+                self.checksum_errors += 1
+                continue
+
+            self._start = pos
+            self.sentences += 1
+            yield view[sop:pos]
+
+        self._start = pos
+
+    def _checksum_ok(self, sop: int, eol: int) -> bool:
+        try:
+            expected = int(self._buffer[eol - 3:eol - 1], 16)
+        except ValueError:
+            return False
+        return checksum(self._view[sop + 1:eol - 4]) == expected
@@ -1,16 +1,178 @@
-import operator
-from functools import reduce
+import threading
+import time
 
 import serial
 from serial.tools import list_ports as tools
 
+import virtualport
+from checksum import checksum
+from framing import NMEAFramer
+from metrics import registry
 
-def checksum(message):
-    return reduce(operator.xor, map(ord, message), 0)
+_bytes_out = registry.counter('bytes_out_total', "bytes written to serial ports")
+_bytes_in = registry.counter('bytes_in_total', "bytes read from serial ports")
+_write_time = registry.histogram('write', "time of one serial write call")
+_checksum_errors = registry.counter('checksum_errors_total', "received sentences with a wrong checksum")
+_resyncs = registry.counter('resyncs_total', "malformed or cut frames skipped by the receiver")
+_write_timeouts = registry.counter('write_timeouts_total', "writes dropped because the line stayed full")
 
 
-def find_ports():
-    return [info.device for info in tools.comports()]
+def find_ports(virtual: bool = True):
+    ports = [info.device for info in tools.comports()]
+    if virtual:
+        ports.extend(virtualport.PORTS)
+    return ports
+
+
+def char_bits(settings: dict) -> float:
+    """ Bits on the wire per byte: start bit, data bits, parity bit, stop bits """
+    bytesize = int(settings.get('bytesize', serial.EIGHTBITS))
+    parity = 0 if settings.get('parity', serial.PARITY_NONE) == serial.PARITY_NONE else 1
+    return 1 + bytesize + parity + float(settings.get('stopbits', serial.STOPBITS_ONE))
+
+
+def line_capacity(settings: dict) -> float:
+    """ Bytes per second the line carries at the configured baudrate """
+    return int(settings['baudrate']) / char_bits(settings)
+
+
+class SerialPool(object):
+    """ Keeps serial handles open between writes.
+
+    Handles are keyed by (port, baudrate, bytesize, parity, stopbits) and reopened
+    after a write error. Every `acquire` is a lease ended by `release` or
+    `invalidate`; a handle is closed once it has no leases and stays unused for
+    `idle_timeout` seconds.
+    """
+    KEYS = ('port', 'baudrate', 'bytesize', 'parity', 'stopbits')
+    DEFAULTS = {
+        'bytesize': serial.EIGHTBITS,
+        'parity': serial.PARITY_NONE,
+        'stopbits': serial.STOPBITS_ONE
+    }
+
+    def __init__(self, idle_timeout: float = 30.0, write_timeout: float = 0.1):
+        self.idle_timeout = idle_timeout
+        self.write_timeout = write_timeout
+        self._handles = {}  # key -> [serial.Serial, last used (monotonic), leases]
+        self._lock = threading.RLock()
+        self._reaper = None
+
+    @classmethod
+    def key(cls, settings: dict) -> tuple:
+        stg = {**cls.DEFAULTS, **settings}
+        stopbits = float(stg['stopbits'])
+        return (
+            stg['port'],
+            int(stg['baudrate']),
+            int(stg['bytesize']),
+            str(stg['parity']),
+            int(stopbits) if stopbits.is_integer() else stopbits
+        )
+
+    def acquire(self, settings: dict) -> serial.Serial:
+        """ Open handle, held open until the matching release or invalidate """
+        key = self.key(settings)
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is None:
+                entry = self._handles[key] = [self._open(key), 0.0, 0]
+            elif not entry[0].is_open:
+                entry[0] = self._open(key)
+            entry[1] = time.monotonic()
+            entry[2] += 1
+            self._start_reaper()
+            return entry[0]
+
+    def release(self, settings: dict) -> None:
+        """ End a lease, the handle is closed by the reaper once unused for idle timeout """
+        with self._lock:
+            entry = self._handles.get(self.key(settings))
+            if entry is not None:
+                entry[1] = time.monotonic()
+                entry[2] = max(entry[2] - 1, 0)
+
+    def invalidate(self, settings: dict) -> None:
+        """ End a lease and close the handle, the next acquire reopens it """
+        key = self.key(settings)
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is None:
+                return
+            entry[2] = max(entry[2] - 1, 0)
+            if not entry[2]:
+                del self._handles[key]
+        self._close(entry[0])
+
+    def write(self, settings: dict, data: bytes) -> int:
+        """ Write data, reopening the port once if the handle went bad.
+
+        A write timeout means the line is full, not broken: the frame is dropped
+        (pyserial may already have sent its start) and 0 is returned.
+        """
+        try:
+            return self._write(settings, data)
+        except (serial.SerialException, OSError):
+            return self._write(settings, data)
+
+    def _write(self, settings: dict, data: bytes) -> int:
+        handle = self.acquire(settings)
+        try:
+            written = handle.write(data)
+        except serial.SerialTimeoutException:
+            self.release(settings)
+            _write_timeouts.inc()
+            return 0
+        except (serial.SerialException, OSError):
+            self.invalidate(settings)
+            raise
+        self.release(settings)
+        return written
+
+    def close_idle(self) -> None:
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            expired = [key for key, (_, used, leases) in self._handles.items() if not leases and used < deadline]
+            handles = [self._handles.pop(key)[0] for key in expired]
+        for handle in handles:
+            self._close(handle)
+
+    def close_all(self) -> None:
+        with self._lock:
+            handles = [entry[0] for entry in self._handles.values()]
+            self._handles.clear()
+        for handle in handles:
+            self._close(handle)
+
+    def _open(self, key: tuple) -> serial.Serial:
+        settings = dict(zip(self.KEYS, key), timeout=0.1, write_timeout=self.write_timeout)
+        if virtualport.is_virtual(settings['port']):
+            return virtualport.open_port(**settings)
+        return serial.Serial(**settings)
+
+    @staticmethod
+    def _close(handle: serial.Serial) -> None:
+        try:
+            handle.close()
+        except (serial.SerialException, OSError):
+            pass
+
+    def _start_reaper(self) -> None:
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(target=self._reap, name='serial-pool', daemon=True)
+            self._reaper.start()
+
+    def _reap(self) -> None:
+        while True:
+            time.sleep(max(self.idle_timeout / 2, 0.1))
+            self.close_idle()
+            with self._lock:
+                if not self._handles:
+                    self._reaper = None
+                    return
+
+
+pool = SerialPool()
 
 
 class SerialPort:
@@ -18,10 +180,7 @@ class SerialPort:
         self._settings = settings
 
     def send(self, message: bytes):
-        with serial.Serial(port=self._settings['port'],
-                           baudrate=self._settings['baudrate'],
-                           timeout=0.1) as serobj:
-            serobj.write(message)
+        pool.write(self._settings, message)
 
 
 class NmeaDriver(object):
@@ -31,20 +190,50 @@ class NmeaDriver(object):
     def __init__(self):
         self.is_running = False
         self.serial_port = None
+        self._settings = None
 
     def open(self, settings: dict) -> None:
-        self.serial_port = serial.Serial(**settings)
+        self._settings = settings
+        self.serial_port = pool.acquire(settings)
 
     def close(self):
-        self.serial_port.close()
-
-    def recieve(self) -> None:
-        return None  # TODO: stub
-        while self.is_running:
-            if self.serial_port.in_waiting > 0:
-                raw_message = self.serial_port.readline().decode('utf-8')
-        if self.serial_port:
-            self.serial_port.close()
-
-    def send(self, message: str) -> int:
-        return self.serial_port.write(message.encode('utf-8'))
+        if self.serial_port is not None:
+            pool.release(self._settings)
+        self.serial_port = None
+
+    def recieve(self, framer: NMEAFramer = None):
+        """ Yield received sentences as memoryview slices until `stop` is called.
+
+        Slices point into the framer buffer, copy them with bytes() to keep them.
+        """
+        framer = framer or NMEAFramer()
+        self.is_running = True
+        try:
+            while self.is_running:
+                count = framer.readfrom(self.serial_port)
+                if count:
+                    _bytes_in.inc(count)
+                    errors, checksum_errors = framer.errors, framer.checksum_errors
+                    yield from framer
+                    _resyncs.inc(framer.errors - errors)
+                    _checksum_errors.inc(framer.checksum_errors - checksum_errors)
+        except (serial.SerialException, OSError):
+            if self.serial_port is not None:
+                pool.invalidate(self._settings)
+                self.serial_port = None
+            raise
+        finally:
+            self.is_running = False
+
+    def stop(self) -> None:
+        self.is_running = False
+
+    def send(self, message) -> int:
+        """ Write str or any bytes-like object (bytes, bytearray, memoryview slice) """
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        started = time.perf_counter_ns()
+        written = pool.write(self._settings, message)
+        _write_time.record(time.perf_counter_ns() - started)
+        _bytes_out.inc(written or 0)
+        return written
@@ -1,25 +1,36 @@
 # -*- coding: utf-8 -*-
 
+import json
 import logging
 import os.path
 import sys
+import time
 
 from PyQt5 import QtCore
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
-from ui.components import OptionBox, Option
+from ui.components import OptionBox, Option, Terminal
 from ui import app_rc
 
 import ioserial
-from protocols import CompassMessage, SonarMessage, HMRDorient
+from engine import TransmitEngine, jitter_report
+from pacing import PacedWriter, COALESCE
+from scheduler import Stream, StreamScheduler, SKIP, CATCH_UP
+from protocols import compile_encoder
+from recorder import CaptureWriter, Recorder, NMEA_MARKER, HMR_MARKER
 from message_desc import messages
+from metrics import registry
 
 __title__ = "NMEA-0183"
 __version__ = "1.0.0"
 __author__ = "Александр Смирнов"
 
 ROOT = os.path.dirname(os.path.realpath(__file__))
+CAPTURE_DIR = "captures"
+
+# index of "Прием" in the transmitDirection option
+RECEIVE = 1
 
 logging.basicConfig(
     level=logging.INFO,
@@ -30,6 +41,12 @@ logging.basicConfig(
     ])
 logger = logging.getLogger()
 
+# refresh period of the terminal and the status bar while transmitting
+GUI_REFRESH_MS = 100
+
+# what a stream that fell behind does, in the order of the "отставание" combo
+LAG_POLICIES = (SKIP, CATCH_UP)
+
 pixmaps = {
     'noconnect': {'ico': ":/rc/network-offline.png", 'description': 'нет подключения'},
     'idle': {'ico': ":/rc/network-idle.png", 'description': 'ожидание'},
@@ -45,6 +62,10 @@ class Ui(QMainWindow):
         super().__init__()
 
         self.timer_id = 0
+        self.engine = None
+        self.writer = None
+        self.recorder = None
+        self.jitter = {}
         self.isBlink = False
         self.status = {}
 
@@ -52,6 +73,8 @@ class Ui(QMainWindow):
         self.message_names = ["compass", "sonar", "sensor"]
         self.mode = 0
 
+        self.encoders = [compile_encoder(name) for name in self.message_names]
+
         self.transceiver = ioserial.NmeaDriver()
 
         self.createUI()
@@ -87,12 +110,13 @@ class Ui(QMainWindow):
         self.stack = QStackedLayout()
         for key in self.message_names:
             box = OptionBox(fields=messages[key]["fields"])
+            box.paramsChanged.connect(lambda params, key=key: self.on_change_params(key, params))
             self.stack.addWidget(box)
         self.stack.setCurrentIndex(0)
 
         le = QLineEdit()
 
-        terminal = self.createTerminal()      
+        self.terminal = Terminal(parent=None)
 
         self.createStatusbar()
         
@@ -110,46 +134,13 @@ class Ui(QMainWindow):
         settingsLayout.addWidget(message_group)
         centralLayout.addLayout(settingsLayout)
         centralLayout.addWidget(le)
-        centralLayout.addWidget(terminal)
+        centralLayout.addWidget(self.terminal)
         centralLayout.addWidget(self.control)
 
         self._center()
 
         self.show()
 
-    def createTerminal(self):   
-        self.terminal = QListView(parent=None)
-        self.terminal.setEditTriggers(QAbstractItemView.NoEditTriggers)
-        self.terminal.setSelectionMode(QAbstractItemView.NoSelection)
-        self.terminal.setFocusPolicy(QtCore.Qt.NoFocus)
-
-        model = QtCore.QStringListModel()
-        self.terminal.setModel(model)
-        
-        def _on_clear():
-            model.setStringList(tuple())
-            
-        def _on_append(item: str):
-            new_item = item
-            model.insertRow(model.rowCount())
-            index = model.index(model.rowCount()-1, 0)
-            model.setData(index, new_item)
-            self.terminal.scrollTo(index) 
-
-        btn_clear = QPushButton('Очистить')
-        btn_clear.setFixedWidth(60)
-        btn_clear.clicked.connect(_on_clear)
-
-        wgt = QWidget()
-        layout = QVBoxLayout(wgt)
-        layout.setContentsMargins(0,0,0,0)
-        layout.addWidget(self.terminal)
-        layout.addWidget(btn_clear)
-
-        self._terminal_on_append = _on_append
-
-        return wgt
-
     def createButtons(self):
         wgt = QWidget()
         layout = QHBoxLayout(wgt)
@@ -187,7 +178,11 @@ class Ui(QMainWindow):
             self.portbox_data = {
                 "port": wgt.findChild(QComboBox, "port").currentText(),
                 "baudrate": int(wgt.findChild(QComboBox, "baudrate").currentText()),
-                "interval": int(wgt.findChild(QComboBox, "interval").currentText())
+                "bytesize": int(wgt.findChild(QComboBox, "bytesize").currentText()),
+                "parity": wgt.findChild(QComboBox, "parity").currentText(),
+                "stopbits": float(wgt.findChild(QComboBox, "stopbits").currentText()),
+                "interval": int(wgt.findChild(QComboBox, "interval").currentText()),
+                "lag": LAG_POLICIES[wgt.findChild(QComboBox, "lag").currentIndex()]
             }
 
         def _on_find_ports():
@@ -204,7 +199,8 @@ class Ui(QMainWindow):
                 ('bytesize', 'биты данных', ['8']),
                 ('parity', 'четность', ['N']),
                 ('stopbits', 'стоп', ['1', '1.5', '2']),
-                ('interval', 'темп, мс', ['1000'])
+                ('interval', 'темп, мс', ['1000']),
+                ('lag', 'отставание', ['пропуск', 'догон'])
         ):
             combo = QComboBox()
             combo.setObjectName(key)
@@ -235,6 +231,14 @@ class Ui(QMainWindow):
 
 
     def createStatusbar(self):
+        metrics = QLabel()
+        metrics.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
+        save = QAction("Сохранить гистограмму джиттера...", metrics)
+        save.triggered.connect(self._on_save_jitter)
+        metrics.addAction(save)
+        self.statusBar().addPermanentWidget(metrics)
+        self.status['metrics'] = metrics
+
         counter = QLabel()
         self.statusBar().addPermanentWidget(counter)
         self.status['counter'] = counter
@@ -255,55 +259,111 @@ class Ui(QMainWindow):
     def _on_start(self):
         self._lock(True)
 
-        stg = self.get_port_settings()
+        stg = dict(self.get_port_settings())
         interval_ms = stg.pop('interval', 1000)
-
-        self.transceiver.open(stg)
+        self.lag = stg.pop('lag', SKIP)
 
         self.message_counter = 0
 
+        if self.transmitDirection.currentIndex() == RECEIVE:
+            self._start_recorder(stg)
+        else:
+            self._start_transmitter(stg, interval_ms)
+
+        self.timer_id = self.startTimer(GUI_REFRESH_MS)
+
+    def _start_transmitter(self, stg, interval_ms):
+        self.transceiver.open(stg)
 
-        self.timer_id = self.startTimer(interval_ms, timerType=QtCore.Qt.PreciseTimer)
+        scheduler = StreamScheduler(ioserial.line_capacity(stg), self.lag)
+        scheduler.add(Stream(self.message_names[self.mode],
+                             self.encoders[self.mode],
+                             1000.0 / interval_ms,
+                             self.get_message_settings()))
+        if scheduler.overloaded:
+            logger.warning("message rate exceeds line capacity (%.0f%%)", scheduler.load() * 100)
+
+        self.writer = PacedWriter(self.transceiver, stg, policy=COALESCE)
+        self.writer.start()
+
+        self.engine = TransmitEngine(self.writer, scheduler)
+        self.engine.start()
+
+    def _start_recorder(self, stg):
+        marker = HMR_MARKER if self.message_names[self.mode] == 'sensor' else NMEA_MARKER
+        name = "{}-{}".format(self.message_names[self.mode], time.strftime("%Y%m%d-%H%M%S"))
+        writer = CaptureWriter(os.path.join(ROOT, CAPTURE_DIR), name=name, marker=marker)
+        logger.info("capture to %s", os.path.join(ROOT, CAPTURE_DIR, name))
+
+        self.recorder = Recorder(stg, writer)
+        self.recorder.start()
+
+    def _stop_workers(self):
+        if self.engine:
+            self.engine.stop()
+            self.jitter = jitter_report(self.engine.scheduler)
+            self.engine = None
+            self.writer.stop()
+            self.transceiver.close()
+        if self.recorder:
+            self.recorder.stop()
+            self.recorder = None
 
     def _on_stop(self):
         if self.timer_id:
             self.killTimer(self.timer_id)
             self.timer_id = 0
-        self.transceiver.close()
+        self._stop_workers()
         self._lock(False)
         self.updatePixmap('idle')
 
     def _on_quit(self):
         if self.timer_id:
             self.killTimer(self.timer_id)
+        self._stop_workers()
+        ioserial.pool.close_all()
         QtCore.QCoreApplication.exit(0)
 
     def closeEvent(self, event):
         self._on_quit()
 
     def timerEvent(self, event):
-        data = self.get_message_settings()
+        if self.recorder:
+            self._update_receive()
+            return
+
+        if not self.engine.is_running:
+            self._on_stop()
+            self.updatePixmap('error')
+            self.statusBar().showMessage("передача прервана, подробности в журнале", 5000)
+            return
+
+        stats = self.engine.stats
+        if stats['encode_errors']:
+            self.statusBar().showMessage("ошибок кодирования: {}, проверьте параметры".format(
+                stats['encode_errors']), GUI_REFRESH_MS * 2)
+        if stats['sent'] == self.message_counter:
+            return
+
+        # show last sent message to terminal
+        self.terminal.append(self.encoders[self.mode].to_ascii(stats['last']))
 
-        if self.mode == 0:
-            message = CompassMessage(data)
-        elif self.mode == 1:
-            message = SonarMessage(data)
-        elif self.mode == 2:
-            message = HMRDorient(data)
+        # update status
+        self.blinkPixmap()
 
-        # send message to serial
-        #msg_bytes = message.to_bytes()
-        self.transceiver.send(message.to_ascii())
+        self.message_counter = stats['sent']
+        self.updateStatus("counter", self.message_counter)
+        self.updateMetrics(stats['streams'][self.message_names[self.mode]]['jitter'])
 
-        # show message to terminal
-        msg_ascii = message.to_ascii()
-        self._terminal_on_append(msg_ascii)
+    def _update_receive(self):
+        stats = self.recorder.stats
+        if stats['sentences'] == self.message_counter:
+            return
 
-        # update status
         self.blinkPixmap()
 
-        self.message_counter += 1
-        self.updateStatus("counter", self.message_counter)
+        self.message_counter = stats['sentences']
+        self.updateStatus("counter", self.message_counter, 'принято')
 
     def _lock(self, is_lock):
         self.portbox.setDisabled(is_lock)
@@ -324,13 +384,36 @@ class Ui(QMainWindow):
         self.status['pixmap'].setPixmap(QPixmap(pixmaps[state]['ico']))
         self.status['pixmap'].setToolTip(pixmaps[state]['description'])
 
-    def updateStatus(self, key, value):
-        self.status[key].setText(' {}: {}'.format('отправлено', value))
+    def updateStatus(self, key, value, label='отправлено'):
+        self.status[key].setText(' {}: {}'.format(label, value))
+
+    def updateMetrics(self, jitter):
+        snapshot = registry.snapshot()
+        self.status['metrics'].setText(' запись p99: {:.0f} мкс, джиттер p50/p99/макс: {:.1f}/{:.1f}/{:.1f} мс'.format(
+            snapshot['write']['p99'] / 1e3, jitter['p50'] / 1e6, jitter['p99'] / 1e6, jitter['max'] / 1e6))
+        self.status['metrics'].setToolTip('\n'.join(
+            '{}: {}'.format(name, value if not isinstance(value, dict) else
+                            ', '.join('{} {}'.format(k, round(v)) for k, v in value.items()))
+            for name, value in sorted(snapshot.items())))
+
+    def _on_save_jitter(self):
+        if not self.jitter:
+            self.statusBar().showMessage("нет данных о джиттере, сначала выполните передачу", 3000)
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Гистограмма джиттера", "jitter.json", "JSON (*.json)")
+        if path:
+            with open(path, 'w') as f:
+                json.dump(self.jitter, f, indent=2)
 
     def on_change_device(self, index: int) -> None:
         self.stack.setCurrentIndex(index)
         self.mode = index
 
+    def on_change_params(self, name: str, params) -> None:
+        # push parameters to the transmit engine
+        if self.engine and name in self.engine.scheduler.streams:
+            self.engine.update(name, params)
+
     def get_port_settings(self):
         return self.portbox_data
 
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+""" Metrics registry: counters, gauges and latency histograms.
+
+Hot paths keep a module-level reference to their metric and update it with one
+attribute operation (histograms: a few integer operations), there is no lock.
+Updates from several threads may race and lose an increment, which is accepted
+for statistics. Snapshots go to the GUI, `MetricsServer` exports them in the
+Prometheus text format for long soak runs:
+
+    server = MetricsServer(registry, port=9108)
+    server.start()          # curl http://127.0.0.1:9108/metrics
+"""
+
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class Counter(object):
+    __slots__ = ('name', 'help', 'value')
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str = '') -> None:
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge(object):
+    __slots__ = ('name', 'help', 'value')
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str = '') -> None:
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def set(self, value) -> None:
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram(object):
+    """ Log-linear buckets over integer nanoseconds, HDR style.
+
+    Every power of two is split into 2**SUB_BITS equal buckets, so a recorded
+    value is known to within 1/2**SUB_BITS (12.5%) at any magnitude.
+    Values above `highest` (default about 68 s) land in the last bucket.
+    """
+    SUB_BITS = 3
+    SUB = 1 << SUB_BITS
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str = '', highest: int = 1 << 36) -> None:
+        self.name = name
+        self.help = help
+        self.highest = highest
+        self.counts = [0] * (self.index(highest) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    @classmethod
+    def index(cls, value: int) -> int:
+        if value < 2 * cls.SUB:
+            return value
+        shift = value.bit_length() - cls.SUB_BITS - 1
+        return shift * cls.SUB + (value >> shift)
+
+    @classmethod
+    def upper(cls, index: int) -> int:
+        """ Smallest value above bucket `index` """
+        if index < 2 * cls.SUB:
+            return index + 1
+        shift = index // cls.SUB - 1
+        return (index - shift * cls.SUB + 1) << shift
+
+    def record(self, value: int) -> None:
+        value = int(value)
+        if value < 0:
+            value = 0
+        elif value > self.highest:
+            value = self.highest
+        self.counts[self.index(value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def percentile(self, q: float) -> int:
+        """ Upper bound of the bucket holding the q-th percentile (0..100) """
+        if not self.count:
+            return 0
+        rank = max(1, round(self.count * q / 100.0))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.upper(i) - 1, self.max)
+        return self.max
+
+    def buckets(self) -> list:
+        """ (low, high, count) of the non-empty buckets, values in [low, high) """
+        return [(self.upper(i - 1) if i else 0, self.upper(i), count)
+                for i, count in enumerate(self.counts) if count]
+
+    def to_dict(self) -> dict:
+        return dict(self.snapshot(), buckets=self.buckets())
+
+    def reset(self) -> None:
+        self.counts = [0] * len(self.counts)
+        self.count = self.sum = self.max = 0
+        self.min = None
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0,
+            'min': self.min or 0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9)
+        }
+
+
+class Registry(object):
+    """ Named metrics, created on first use """
+
+    def __init__(self, prefix: str = 'nmea_') -> None:
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str = '') -> Counter:
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str = '') -> Gauge:
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name: str, help: str = '') -> Histogram:
+        """ Histogram of nanosecond values, exported in seconds """
+        return self._get(Histogram, name, help)
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in list(self._metrics.items())}
+
+    def prometheus(self) -> str:
+        """ Text exposition format, version 0.0.4 """
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            name = self.prefix + name
+            if metric.kind == 'histogram':
+                name += '_seconds'
+            if metric.help:
+                lines.append('# HELP {} {}'.format(name, metric.help))
+            lines.append('# TYPE {} {}'.format(name, metric.kind))
+            if metric.kind != 'histogram':
+                lines.append('{} {}'.format(name, metric.value))
+                continue
+            # cumulative buckets at powers of two up to the largest value seen
+            counts, seen, bound = metric.counts, 0, 1
+            for i, count in enumerate(counts):
+                if metric.upper(i) > bound:
+                    lines.append('{}_bucket{{le="{:.9g}"}} {}'.format(name, bound / 1e9, seen))
+                    if bound > metric.max:
+                        break
+                    bound <<= 1
+                seen += count
+            lines.append('{}_bucket{{le="+Inf"}} {}'.format(name, metric.count))
+            lines.append('{}_sum {:.9g}'.format(name, metric.sum / 1e9))
+            lines.append('{}_count {}'.format(name, metric.count))
+        return '\n'.join(lines) + '\n'
+
+    def _get(self, cls, name: str, help: str):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(name, cls(name, help))
+        if not isinstance(metric, cls):
+            raise TypeError("metric {} is a {}".format(name, metric.kind))
+        return metric
+
+
+registry = Registry()
+
+
+class MetricsServer(object):
+    """ Serves GET /metrics in the Prometheus text format from a background thread """
+
+    def __init__(self, registry: Registry = registry, host: str = '127.0.0.1', port: int = 9108) -> None:
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    @property
+    def address(self) -> tuple:
+        return self._server.server_address if self._server else (self.host, self.port)
+
+    def start(self) -> None:
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+        logger.info("metrics on http://%s:%d/metrics", *self.address[:2])
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self._thread = None
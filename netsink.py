@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+""" Network outputs for NMEA: UDP datagrams and a TCP server.
+
+Both drivers have the interface of ioserial.NmeaDriver (`open(settings)`,
+`send(message)`, `close()`), the destination is given as the port:
+
+    {'port': 'udp://255.255.255.255:10110'}   broadcast
+    {'port': 'udp://239.192.0.1:10110'}       multicast
+    {'port': 'tcp://0.0.0.0:10110'}           server for any number of clients
+
+UDP packs several sentences into one datagram up to `mtu` bytes and sends what
+is left after `max_delay` seconds. TCP writes to every connected client without
+blocking; a client whose backlog grows over `max_pending` bytes is disconnected.
+"""
+
+import ipaddress
+import logging
+import os
+import selectors
+import socket
+import threading
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+NMEA_PORT = 10110
+SCHEMES = ('udp', 'tcp')
+
+
+def is_network(port: str) -> bool:
+    return port.partition('://')[0] in SCHEMES
+
+
+def address(port: str) -> tuple:
+    """ (scheme, host, port number) of a `udp://host:port` or `tcp://host:port` destination """
+    url = urlsplit(port)
+    if url.scheme not in SCHEMES:
+        raise ValueError("not a network destination: {}".format(port))
+    return url.scheme, url.hostname or '0.0.0.0', url.port or NMEA_PORT
+
+
+def open_driver(settings: dict):
+    """ Open the driver matching the scheme of settings['port'] """
+    scheme, _, _ = address(settings['port'])
+    driver = UdpDriver() if scheme == 'udp' else TcpDriver()
+    driver.open(settings)
+    return driver
+
+
+class UdpDriver(object):
+    """ Sends sentences in datagrams of up to `mtu` bytes """
+
+    def __init__(self, mtu: int = 1472, max_delay: float = 0.02) -> None:
+        self.mtu = mtu
+        self.max_delay = max_delay
+        self._socket = None
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # statistics
+        self.datagrams = 0
+        self.sentences = 0
+        self.bytes = 0
+        self.errors = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'datagrams': self.datagrams,
+            'sentences': self.sentences,
+            'bytes': self.bytes,
+            'errors': self.errors
+        }
+
+    def open(self, settings: dict) -> None:
+        _, host, port = address(settings['port'])
+        # host names are resolved once, the multicast check needs the numeric address
+        *_, destination = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_DGRAM)[0]
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        if ipaddress.ip_address(destination[0]).is_multicast:
+            self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, int(settings.get('ttl', 1)))
+        self._socket.connect(destination)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='udp', daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+        if self._socket is not None:
+            with self._lock:
+                self._flush()
+            self._socket.close()
+            self._socket = None
+
+    def send(self, message) -> int:
+        """ Queue a sentence, the datagram goes out once it is full or `max_delay` passed """
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        with self._lock:
+            if len(self._buffer) + len(message) > self.mtu:
+                self._flush()
+            self._buffer += message
+            self.sentences += 1
+        return len(message)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.max_delay):
+            with self._lock:
+                self._flush()
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+        try:
+            self.bytes += self._socket.send(self._buffer)
+            self.datagrams += 1
+        except OSError as e:
+            # nobody listening on a unicast address, network down...
+            self.errors += 1
+            logger.debug("udp send failed: %s", e)
+        self._buffer.clear()
+
+
+class _Client(object):
+
+    def __init__(self, sock: socket.socket, peer) -> None:
+        self.socket = sock
+        self.peer = peer
+        self.pending = bytearray()
+
+
+class TcpDriver(object):
+    """ TCP server sending every sentence to all connected clients """
+
+    def __init__(self, max_pending: int = 1 << 16, backlog: int = 64) -> None:
+        self.max_pending = max_pending
+        self.backlog = backlog
+        self.address = None  # (host, port) actually bound, port 0 picks a free one
+        self._server = None
+        self._clients = {}  # fd -> _Client
+        self._lock = threading.Lock()
+        self._selector = None
+        self._wakeup = None
+        self._running = False
+        self._thread = None
+
+        # statistics
+        self.sentences = 0
+        self.bytes = 0
+        self.accepted = 0
+        self.evicted = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'clients': len(self._clients),
+            'accepted': self.accepted,
+            'evicted': self.evicted,
+            'sentences': self.sentences,
+            'bytes': self.bytes
+        }
+
+    def open(self, settings: dict) -> None:
+        _, host, port = address(settings['port'])
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(self.backlog)
+        self._server.setblocking(False)
+        self.address = self._server.getsockname()
+
+        self._selector = selectors.DefaultSelector()
+        self._wakeup = os.pipe()
+        os.set_blocking(self._wakeup[1], False)
+        self._selector.register(self._wakeup[0], selectors.EVENT_READ)
+        self._selector.register(self._server, selectors.EVENT_READ)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='tcp', daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        self._running = False
+        self._wake()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+        with self._lock:
+            for client in list(self._clients.values()):
+                self._drop(client)
+        self._selector.close()
+        self._server.close()
+        self._server = None
+        for fd in self._wakeup:
+            os.close(fd)
+
+    def send(self, message) -> int:
+        """ Write to every client, never blocks on a slow one """
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        wake = False
+        with self._lock:
+            self.sentences += 1
+            for client in list(self._clients.values()):
+                if client.pending:
+                    if len(client.pending) + len(message) > self.max_pending:
+                        logger.info("%s:%d: too slow, disconnected", *client.peer[:2])
+                        self.evicted += 1
+                        self._drop(client)
+                    else:
+                        client.pending += message
+                    continue
+                try:
+                    written = client.socket.send(message)
+                except BlockingIOError:
+                    written = 0
+                except OSError:
+                    self._drop(client)
+                    continue
+                self.bytes += written
+                if written < len(message):
+                    client.pending += memoryview(message)[written:]
+                    wake = True
+        if wake:
+            self._wake()
+        return len(message)
+
+    def _run(self) -> None:
+        while self._running:
+            with self._lock:
+                for client in self._clients.values():
+                    events = selectors.EVENT_READ
+                    if client.pending:
+                        events |= selectors.EVENT_WRITE
+                    self._selector.modify(client.socket, events, client)
+
+            for key, events in self._selector.select(timeout=1.0):
+                if key.fd == self._wakeup[0]:
+                    try:
+                        os.read(self._wakeup[0], 512)
+                    except BlockingIOError:
+                        pass
+                elif key.fileobj is self._server:
+                    self._accept()
+                else:
+                    with self._lock:
+                        if key.data.socket.fileno() in self._clients:
+                            self._service(key.data, events)
+
+    def _accept(self) -> None:
+        try:
+            sock, peer = self._server.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(sock, peer)
+        with self._lock:
+            self._clients[sock.fileno()] = client
+            self._selector.register(sock, selectors.EVENT_READ, client)
+        self.accepted += 1
+        logger.info("%s:%d: connected", *peer[:2])
+
+    def _service(self, client: _Client, events: int) -> None:
+        try:
+            if events & selectors.EVENT_READ and not client.socket.recv(4096):
+                self._drop(client)  # closed by the peer
+                return
+            if events & selectors.EVENT_WRITE and client.pending:
+                written = client.socket.send(client.pending)
+                del client.pending[:written]
+                self.bytes += written
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._drop(client)
+
+    def _drop(self, client: _Client) -> None:
+        self._clients.pop(client.socket.fileno(), None)
+        try:
+            self._selector.unregister(client.socket)
+        except (KeyError, ValueError):
+            pass
+        client.socket.close()
+
+    def _wake(self) -> None:
+        try:
+            os.write(self._wakeup[1], b'\0')
+        except (BlockingIOError, OSError):
+            pass
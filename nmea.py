@@ -1,13 +1,377 @@
+# -*- coding: utf-8 -*-
+""" NMEA-0183 sentence parser.
 
-def checksum(message: str) -> int:
-    return reduce(operator.xor, map(ord, message), 0)
+Sentences are looked up in a dispatch table by talker + formatter (`HCHDT`)
+and then by formatter alone (`HDT`); proprietary `$P` sentences by their
+manufacturer code. A parsed sentence only keeps a copy of the raw bytes, field
+offsets are found on the first field access and a field is decoded when it is
+read, so dropping unwanted types from a fast stream costs a slice compare:
 
+    parser = Parser(types=('HDT', 'GGA'))
+    for raw in driver.recieve():
+        sentence = parser.parse(raw)
+        if sentence is not None:
+            print(sentence.formatter, sentence.as_dict())
+"""
 
-class HCHDT(object):
-    def parse(self, message: str) -> None:
-        pass
+import datetime
 
-    def create(self, param: dict) -> None:
-        data = f""
-        cs = checksum(data)
-        return f"{self.ID},{data},{checksum}"
\ No newline at end of file
+from checksum import checksum
+
+
+def _float(raw: bytes):
+    return float(raw)
+
+
+def _int(raw: bytes):
+    return int(raw)
+
+
+def _str(raw: bytes):
+    return raw.decode('ascii')
+
+
+def _time(raw: bytes):
+    """ hhmmss[.ss] in UTC """
+    seconds = float(raw[4:])
+    return datetime.time(int(raw[0:2]), int(raw[2:4]), int(seconds), int(round(seconds % 1 * 1e6)) % 1000000,
+                         tzinfo=datetime.timezone.utc)
+
+
+def _date(raw: bytes):
+    """ ddmmyy, years from 80 on are 19xx """
+    year = int(raw[4:6])
+    return datetime.date(year + (1900 if year >= 80 else 2000), int(raw[2:4]), int(raw[0:2]))
+
+
+class Field(object):
+    """ Descriptor decoding field `index` with `convert` on access, empty fields read as None """
+
+    def __init__(self, index: int, convert=_str) -> None:
+        self.index = index
+        self.convert = convert
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.name = name
+
+    def __get__(self, sentence, owner=None):
+        if sentence is None:
+            return self
+        cache = sentence._cache
+        try:
+            return cache[self.name]
+        except KeyError:
+            pass
+        raw = sentence.field(self.index)
+        value = self.convert(raw) if raw else None
+        cache[self.name] = value
+        return value
+
+
+class Coordinate(Field):
+    """ (d)ddmm.mmmm plus hemisphere field, decoded to signed degrees """
+
+    def __init__(self, index: int, width: int) -> None:
+        super().__init__(index)
+        self.width = width
+
+    def __get__(self, sentence, owner=None):
+        if sentence is None:
+            return self
+        cache = sentence._cache
+        if self.name not in cache:
+            raw, hemisphere = sentence.field(self.index), sentence.field(self.index + 1)
+            value = None
+            if raw:
+                value = int(raw[:self.width]) + float(raw[self.width:]) / 60.0
+                if hemisphere in (b'S', b'W'):
+                    value = -value
+            cache[self.name] = value
+        return cache[self.name]
+
+
+class Sentence(object):
+    """ Raw sentence with lazily located and decoded fields """
+    __slots__ = ('raw', '_offsets', '_cache')
+    FORMATTER = None
+    FIELDS = ()  # names of the Field descriptors, in sentence order
+
+    def __init__(self, raw) -> None:
+        self.raw = bytes(raw)
+        self._offsets = None
+        self._cache = {}
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.raw)
+
+    @property
+    def address(self) -> str:
+        return self.raw[1:self.raw.find(b',')].decode('ascii')
+
+    @property
+    def talker(self) -> str:
+        return self.address[:2]
+
+    @property
+    def formatter(self) -> str:
+        return self.address[2:]
+
+    @property
+    def valid(self) -> bool:
+        """ Checksum matches (sentences without one count as valid) """
+        star = self.raw.rfind(b'*')
+        if star < 0:
+            return True
+        try:
+            return checksum(self.raw[1:star]) == int(self.raw[star + 1:star + 3], 16)
+        except ValueError:
+            return False
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def offsets(self) -> tuple:
+        """ Start of every data field, plus one past the end of the last """
+        if self._offsets is None:
+            raw = self.raw
+            end = raw.rfind(b'*')
+            if end < 0:
+                end = len(raw.rstrip(b'\r\n'))
+            offsets, pos = [], raw.find(b',')
+            while 0 <= pos < end:
+                offsets.append(pos + 1)
+                pos = raw.find(b',', pos + 1, end)
+            offsets.append(end + 1)
+            self._offsets = tuple(offsets)
+        return self._offsets
+
+    def field(self, index: int) -> bytes:
+        """ Raw bytes of data field `index` (0 is the first after the address), b'' if absent """
+        offsets = self.offsets
+        if index + 1 >= len(offsets):
+            return b''
+        return self.raw[offsets[index]:offsets[index + 1] - 1]
+
+    @property
+    def fields(self) -> list:
+        return [self.field(i) for i in range(len(self))]
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def _signed(self, index: int):
+        """ Value field followed by an E/W field, west negative """
+        raw = self.field(index)
+        if not raw:
+            return None
+        return -float(raw) if self.field(index + 1) == b'W' else float(raw)
+
+
+class ProprietarySentence(Sentence):
+    """ `$P` + three letter manufacturer code, fields are left raw """
+    __slots__ = ()
+    MANUFACTURER = None
+
+    @property
+    def talker(self) -> str:
+        return 'P'
+
+    @property
+    def manufacturer(self) -> str:
+        return self.address[1:4]
+
+    @property
+    def formatter(self) -> str:
+        return self.address[4:]
+
+
+# --- dispatch table -------------------------------------------------------
+
+_sentences = {}  # b'HDT' or b'HCHDT' -> Sentence subclass
+_proprietary = {}  # b'GRM' -> ProprietarySentence subclass
+_P = ord('P')
+
+
+def register(cls):
+    """ Class decorator: add a Sentence subclass to the dispatch table by its FORMATTER.
+
+    A five letter FORMATTER (talker + formatter) takes precedence over the plain one,
+    ProprietarySentence subclasses are registered by MANUFACTURER.
+    """
+    if issubclass(cls, ProprietarySentence):
+        _proprietary[cls.MANUFACTURER.encode('ascii')] = cls
+    else:
+        _sentences[cls.FORMATTER.encode('ascii')] = cls
+    return cls
+
+
+def sentence_class(raw) -> type:
+    """ Class parsing raw, Sentence for unknown types """
+    if raw[1] == _P:
+        return _proprietary.get(bytes(raw[2:5]), ProprietarySentence)
+    return _sentences.get(bytes(raw[1:6])) or _sentences.get(bytes(raw[3:6]), Sentence)
+
+
+def parse(raw) -> Sentence:
+    return sentence_class(raw)(raw)
+
+
+class Parser(object):
+    """ Parses a sentence stream, keeping only `types` (formatters like 'HDT', 'P' for proprietary) """
+
+    def __init__(self, types=None, verify: bool = False) -> None:
+        self.types = None if types is None else {t.encode('ascii') for t in types}
+        self.verify = verify
+
+        # statistics
+        self.parsed = 0
+        self.filtered = 0
+        self.invalid = 0
+
+    def parse(self, raw):
+        """ Sentence, or None if raw is filtered out or fails verification """
+        if self.types is not None:
+            key = b'P' if raw[1] == _P else bytes(raw[3:6])
+            if key not in self.types:
+                self.filtered += 1
+                return None
+        sentence = sentence_class(raw)(raw)
+        if self.verify and not sentence.valid:
+            self.invalid += 1
+            return None
+        self.parsed += 1
+        return sentence
+
+    def __call__(self, stream):
+        """ Generator over the sentences of an iterable of raw sentences """
+        parse = self.parse
+        for raw in stream:
+            sentence = parse(raw)
+            if sentence is not None:
+                yield sentence
+
+
+# --- sentences ------------------------------------------------------------
+
+@register
+class HDT(Sentence):
+    """ Heading, true """
+    __slots__ = ()
+    FORMATTER = 'HDT'
+    FIELDS = ('heading',)
+    heading = Field(0, _float)
+
+
+@register
+class DBT(Sentence):
+    """ Depth below transducer """
+    __slots__ = ()
+    FORMATTER = 'DBT'
+    FIELDS = ('depth_feet', 'depth_meters', 'depth_fathoms')
+    depth_feet = Field(0, _float)
+    depth_meters = Field(2, _float)
+    depth_fathoms = Field(4, _float)
+
+
+@register
+class GGA(Sentence):
+    """ GPS fix data """
+    __slots__ = ()
+    FORMATTER = 'GGA'
+    FIELDS = ('time', 'latitude', 'longitude', 'quality', 'satellites', 'hdop', 'altitude',
+              'geoid_separation', 'dgps_age', 'dgps_station')
+    time = Field(0, _time)
+    latitude = Coordinate(1, 2)
+    longitude = Coordinate(3, 3)
+    quality = Field(5, _int)
+    satellites = Field(6, _int)
+    hdop = Field(7, _float)
+    altitude = Field(8, _float)
+    geoid_separation = Field(10, _float)
+    dgps_age = Field(12, _float)
+    dgps_station = Field(13)
+
+
+@register
+class RMC(Sentence):
+    """ Recommended minimum navigation data """
+    __slots__ = ()
+    FORMATTER = 'RMC'
+    FIELDS = ('time', 'status', 'latitude', 'longitude', 'speed_knots', 'course', 'date',
+              'variation', 'mode')
+    time = Field(0, _time)
+    status = Field(1)
+    latitude = Coordinate(2, 2)
+    longitude = Coordinate(4, 3)
+    speed_knots = Field(6, _float)
+    course = Field(7, _float)
+    date = Field(8, _date)
+    mode = Field(11)
+
+    @property
+    def variation(self):
+        """ Magnetic variation, east positive """
+        return self._signed(9)
+
+
+@register
+class VTG(Sentence):
+    """ Course and speed over ground """
+    __slots__ = ()
+    FORMATTER = 'VTG'
+    FIELDS = ('course_true', 'course_magnetic', 'speed_knots', 'speed_kmh', 'mode')
+    course_true = Field(0, _float)
+    course_magnetic = Field(2, _float)
+    speed_knots = Field(4, _float)
+    speed_kmh = Field(6, _float)
+    mode = Field(8)
+
+
+@register
+class HDG(Sentence):
+    """ Magnetic heading, deviation and variation (east positive) """
+    __slots__ = ()
+    FORMATTER = 'HDG'
+    FIELDS = ('heading', 'deviation', 'variation')
+    heading = Field(0, _float)
+
+    @property
+    def deviation(self):
+        return self._signed(1)
+
+    @property
+    def variation(self):
+        return self._signed(3)
+
+
+@register
+class MTW(Sentence):
+    """ Water temperature, degrees Celsius """
+    __slots__ = ()
+    FORMATTER = 'MTW'
+    FIELDS = ('temperature',)
+    temperature = Field(0, _float)
+
+
+@register
+class DPT(Sentence):
+    """ Depth below transducer and transducer offset (positive: to waterline) """
+    __slots__ = ()
+    FORMATTER = 'DPT'
+    FIELDS = ('depth', 'offset', 'max_range')
+    depth = Field(0, _float)
+    offset = Field(1, _float)
+    max_range = Field(2, _float)
+
+
+@register
+class VHW(Sentence):
+    """ Water speed and heading """
+    __slots__ = ()
+    FORMATTER = 'VHW'
+    FIELDS = ('heading_true', 'heading_magnetic', 'speed_knots', 'speed_kmh')
+    heading_true = Field(0, _float)
+    heading_magnetic = Field(2, _float)
+    speed_knots = Field(4, _float)
+    speed_kmh = Field(6, _float)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+""" Baud-rate pacing of serial writes.
+
+PacedWriter sits in front of a driver with the same `send` method. Frames are
+queued and written by a background thread no faster than the line carries them,
+computed from the bits on the wire per byte. When the queue is full the
+overload policy decides what happens to the new frame.
+"""
+
+import collections
+import itertools
+import logging
+import threading
+import time
+
+import ioserial
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop-oldest'
+COALESCE = 'coalesce'
+BLOCK = 'block'
+POLICIES = (DROP_OLDEST, COALESCE, BLOCK)
+
+
+def frame_key(frame) -> bytes:
+    """ Sentence type of a frame: `$HCHDT` for NMEA, the header for HMR binary """
+    frame = bytes(frame[:16])
+    if frame[:1] == b'$':
+        comma = frame.find(b',')
+        return frame[:comma] if comma > 0 else frame
+    return frame[:4]
+
+
+class PacedWriter(object):
+    """ Writes frames through `driver` at the line rate of `settings` """
+
+    def __init__(self, driver, settings: dict, policy: str = DROP_OLDEST, max_queue: int = 64) -> None:
+        if policy not in POLICIES:
+            raise ValueError("unknown overload policy: {}".format(policy))
+        self.driver = driver
+        self.policy = policy
+        self.max_queue = max_queue
+        self.ns_per_byte = ioserial.char_bits(settings) * 1e9 / int(settings['baudrate'])
+
+        self._queue = collections.OrderedDict()  # key -> frame, oldest first
+        self._unique = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._line_free = 0
+        self._started = 0
+        self._busy = 0
+
+        # statistics
+        self.written = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def utilisation(self) -> float:
+        """ Part of the elapsed time the line has been busy sending """
+        elapsed = time.monotonic_ns() - self._started
+        return min(self._busy / elapsed, 1.0) if self._started and elapsed > 0 else 0.0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'queue': self.queue_depth,
+            'utilisation': self.utilisation,
+            'written': self.written,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'errors': self.errors
+        }
+
+    def start(self) -> None:
+        self._running = True
+        self._started = self._line_free = time.monotonic_ns()
+        self._thread = threading.Thread(target=self._run, name='paced-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 1.0) -> None:
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def send(self, frame) -> int:
+        """ Queue a frame, return its size or 0 if it was dropped """
+        key = frame_key(frame) if self.policy == COALESCE else next(self._unique)
+        with self._cond:
+            if key in self._queue:
+                self._queue[key] = frame  # keeps its place, latest value wins
+                self.coalesced += 1
+                return len(frame)
+
+            while len(self._queue) >= self.max_queue:
+                if self.policy != BLOCK:
+                    self._queue.popitem(last=False)
+                    self.dropped += 1
+                elif not self._running:
+                    self.dropped += 1
+                    return 0
+                else:
+                    self._cond.wait()
+
+            self._queue[key] = frame
+            self._cond.notify_all()
+        return len(frame)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                _, frame = self._queue.popitem(last=False)
+                self._cond.notify_all()
+
+            now = time.monotonic_ns()
+            if self._line_free > now:
+                time.sleep((self._line_free - now) / 1e9)
+                now = self._line_free
+
+            try:
+                self.driver.send(frame)
+                self.written += 1
+            except OSError as e:
+                self.errors += 1
+                logger.warning("send failed: %s", e)
+
+            wire = int(len(frame) * self.ns_per_byte)
+            self._line_free = now + wire
+            self._busy += wire
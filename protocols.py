@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
-from ioserial import checksum
+import struct
+
+from checksum import checksum
+from framing import Framer
+from message_desc import messages
 
 
 class BaseSentence(object):
@@ -14,6 +18,8 @@ class BaseSentence(object):
 class NMEAMessage(BaseSentence):
     START = '$'
     END = '\r\n'
+    formats = {}    # field -> format string of the value
+    constants = {}  # field -> value that never changes
 
     def __repr__(self):
         return "{} {}".format(self.__class__.__name__, str(self.__dict__['fields']))
@@ -38,6 +44,8 @@ class SonarMessage(NMEAMessage):
                             'depth', 'depth unit',
                             'danger', 'danger unit',
                             'accuracy'], '')
+    formats = {'depth': '{:06.1f}', 'danger': '{:02.0f}'}
+    constants = {'field1': '', 'field2': '', 'depth unit': 'M', 'danger unit': 'M'}
 
     def __init__(self, input_data: dict) -> None:
         self._data = input_data
@@ -47,10 +55,9 @@ class SonarMessage(NMEAMessage):
 
     def _format_input_data(self):
         """ Formatting input data  """
-        self._data['depth'] = str(round(self._data['depth'], 2)).zfill(6)
-        self._data['depth unit'] = 'M'
-        self._data['danger'] = str(round(self._data['danger'], 2)).zfill(2)
-        self._data['danger unit'] = 'M'
+        for key, fmt in self.formats.items():
+            self._data[key] = fmt.format(self._data[key])
+        self._data.update(self.constants)
 
 
 class CompassMessage(NMEAMessage):
@@ -58,6 +65,7 @@ class CompassMessage(NMEAMessage):
     fields = dict.fromkeys(
         ('id', 'heading', 'power')
     )
+    formats = {'heading': '{:05.1f}'}
 
     def __init__(self, input_data: dict) -> None:
         self._data = input_data
@@ -66,7 +74,15 @@ class CompassMessage(NMEAMessage):
         self._create_message()
 
     def _format_input_data(self):
-        self._data['heading'] = str(round(self._data['heading'], 1)).zfill(5)
+        for key, fmt in self.formats.items():
+            self._data[key] = fmt.format(self._data[key])
+
+
+# scale of the HMR raw words: 65536 counts span 359.9 degrees and 750 field units
+KANG_PER_DEG = 65536.0 / 359.9
+DEG_PER_KANG = 359.9 / 65536.0
+GAUSS_PER_TESLA = 65536.0 / 750.0
+TESLA_PER_GAUSS = 750.0 / 65536.0
 
 
 def kang2dec(kang, signed=True):
@@ -74,7 +90,9 @@ def kang2dec(kang, signed=True):
 
 
 def dec2kang(dec, signed=True):
-    return (int(dec * 65536.0 / 359.9)).to_bytes(2, byteorder='little', signed=signed)
+    """ Unsigned values (heading) wrap around the circle, 359.9 is 0 """
+    kang = int(dec * 65536.0 / 359.9)
+    return (kang if signed else kang & 0xFFFF).to_bytes(2, byteorder='little', signed=signed)
 
 
 def gauss2tesla(gauss):
@@ -94,10 +112,20 @@ class HMRSentences(BaseSentence):
 class HMRDorient(HMRSentences):
     MID = bytes.fromhex("70")
     LENGTH = (18).to_bytes(1, byteorder='little')
+    FIELDS = ('roll', 'pitch', 'heading', 'magc', 'magb', 'magz')
+    FRAME = struct.Struct('<3sBBhhHhhh')
 
     def __init__(self, data: dict):
         self._data = data
 
+    @classmethod
+    def from_bytes(cls, frame) -> 'HMRDorient':
+        """ Inverse of to_bytes for a single complete frame """
+        preamble, mid, length, *values = cls.FRAME.unpack_from(frame)
+        if preamble != cls.SOP1 + cls.SOP2 + cls.SOP3 or mid != cls.MID[0] or length != cls.LENGTH[0]:
+            raise ValueError("not a HMR orientation frame")
+        return cls(_scale_orientation(values))
+
     def to_bytes(self):
         data_bytes = [self.SOP1, self.SOP2, self.SOP3, self.MID, self.LENGTH]
         for key, value in self._data.items():
@@ -114,3 +142,145 @@ class HMRDorient(HMRSentences):
 
     def to_ascii(self):
         return self.to_bytes().hex(' ')
+
+
+def _scale_orientation(values) -> dict:
+    """ Raw little-endian words to the same units kang2dec/gauss2tesla produce """
+    roll, pitch, heading, magc, magb, magz = values
+    return {
+        'roll': round(roll * DEG_PER_KANG, 3),
+        'pitch': round(pitch * DEG_PER_KANG, 3),
+        'heading': round(heading * DEG_PER_KANG, 3),
+        'magc': round(magc * TESLA_PER_GAUSS, 3),
+        'magb': round(magb * TESLA_PER_GAUSS, 3),
+        'magz': round(magz * TESLA_PER_GAUSS, 3)
+    }
+
+
+class HMRDecoder(Framer):
+    """ Streaming decoder of HMRDorient frames.
+
+    Scans the buffer for the SOP1/SOP2/SOP3 preamble and yields decoded parameter
+    dicts. A frame with wrong MID or LENGTH is dropped and the scan resumes right
+    after its preamble, bytes already passed over are never looked at again.
+    """
+    PREAMBLE = HMRSentences.SOP1 + HMRSentences.SOP2 + HMRSentences.SOP3
+
+    def __init__(self, size: int = 1 << 16) -> None:
+        super().__init__(size)
+        self.frames = 0
+        self.errors = 0
+        self.garbage = 0
+
+    def __iter__(self):
+        buf, frame = self._buffer, HMRDorient.FRAME
+        mid, length = HMRDorient.MID[0], HMRDorient.LENGTH[0]
+        pos, end = self._start, self._end
+        while True:
+            sop = buf.find(self.PREAMBLE, pos, end)
+            if sop < 0:
+                # keep a possibly split preamble for the next read
+                keep = max(pos, end - len(self.PREAMBLE) + 1)
+                self.garbage += keep - pos
+                pos = keep
+                break
+            self.garbage += sop - pos
+
+            if end - sop < frame.size:
+                pos = sop  # partial frame, wait for more bytes
+                break
+
+            if buf[sop + 3] != mid or buf[sop + 4] != length:
+                self.errors += 1
+                pos = sop + len(self.PREAMBLE)
+                continue
+
+            pos = sop + frame.size
+            self._start = pos
+            self.frames += 1
+            yield _scale_orientation(frame.unpack_from(buf, sop)[3:])
+
+        self._start = pos
+
+
+class NMEAEncoder(object):
+    """ Specialised encoder of one NMEA message type.
+
+    Field order is fixed at compile time, single-choice schema fields (talker ID)
+    and class constants are folded into the template, and the checksum of the
+    constant prefix is precomputed, so encoding is one format call plus a XOR over
+    the variable part.
+    """
+
+    def __init__(self, message_cls, fields: tuple) -> None:
+        constants = dict(message_cls.constants)
+        for key, _, items in fields:
+            if isinstance(items, list) and len(items) == 1:
+                constants[key] = items[0]
+
+        order = tuple(message_cls.fields)
+        split = next((i for i, key in enumerate(order) if key not in constants), len(order))
+
+        # constant fields before the first variable one go to the checksummed prefix
+        prefix = ','.join(str(constants[key]) for key in order[:split])
+        if split < len(order):
+            prefix += ','
+
+        # body layout: (None, constant text) or (key, format string)
+        self.layout = tuple(
+            (None, str(constants[key])) if key in constants else (key, message_cls.formats.get(key, '{}'))
+            for key in order[split:]
+        )
+        self.keys = tuple(key for key, _ in self.layout if key is not None)
+
+        parts, index = [], 0
+        for key, text in self.layout:
+            if key is None:
+                parts.append(text.replace('{', '{{').replace('}', '}}'))
+            else:
+                parts.append(text.replace('{', '{%d' % index, 1))
+                index += 1
+        self.prefix = message_cls.START + prefix
+        self.prefix_checksum = checksum(prefix)
+        self.end = message_cls.END
+        self._format = ','.join(parts).format
+
+    def encode(self, params: dict) -> bytes:
+        body = self._format(*[params[key] for key in self.keys])
+        return f"{self.prefix}{body}*{self.prefix_checksum ^ checksum(body):02X}{self.end}".encode()
+
+    @staticmethod
+    def to_ascii(sentence: bytes) -> str:
+        return sentence.decode().rstrip('\r\n')
+
+
+class HMREncoder(object):
+    """ Specialised encoder of HMRDorient frames with a precomputed header """
+
+    def __init__(self, message_cls=None, fields: tuple = ()) -> None:
+        self._header = HMRDecoder.PREAMBLE + HMRDorient.MID + HMRDorient.LENGTH
+        self._pack = struct.Struct('<hhHhhh').pack
+
+    def encode(self, params: dict) -> bytes:
+        kang, gauss = KANG_PER_DEG, GAUSS_PER_TESLA
+        return self._header + self._pack(
+            int(params['roll'] * kang), int(params['pitch'] * kang), int(params['heading'] * kang) & 0xFFFF,
+            int(params['magc'] * gauss), int(params['magb'] * gauss), int(params['magz'] * gauss)
+        )
+
+    @staticmethod
+    def to_ascii(frame: bytes) -> str:
+        return frame.hex(' ')
+
+
+message_types = {
+    'compass': (CompassMessage, NMEAEncoder),
+    'sonar': (SonarMessage, NMEAEncoder),
+    'sensor': (HMRDorient, HMREncoder)
+}
+
+
+def compile_encoder(name: str):
+    """ Build the encoder of message_desc.messages[name] """
+    message_cls, encoder_cls = message_types[name]
+    return encoder_cls(message_cls, messages[name]['fields'])
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+""" Capture-to-disk recorder for the receive direction.
+
+Raw received bytes are appended to segment files `<name>.NNNN.log` through a
+large write buffer. Every `index_every` sentences a record
+(monotonic timestamp, offset in segment, sentence type) is appended to the
+matching `<name>.NNNN.idx`, so a reader finds any moment of a long capture
+with a binary search over the index instead of rescanning the log.
+"""
+
+import bisect
+import glob
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+import ioserial
+from protocols import HMRDecoder
+
+logger = logging.getLogger(__name__)
+
+NMEA_MARKER = b'$'
+HMR_MARKER = HMRDecoder.PREAMBLE
+
+INDEX_MAGIC = b'NMEAIDX\0'
+INDEX_HEADER = struct.Struct('<8sqq')  # magic, wall clock ns and monotonic ns at segment start
+INDEX_RECORD = struct.Struct('<qq8s')  # monotonic ns, offset in segment, sentence type
+
+
+def sentence_type(data, start: int, marker: bytes) -> bytes:
+    """ `HCHDT` for NMEA, the MID byte for HMR frames """
+    if marker == NMEA_MARKER:
+        head = bytes(data[start + 1:start + 9])
+        comma = head.find(b',')
+        return head[:comma] if comma >= 0 else head
+    return bytes(data[start + len(marker):start + len(marker) + 1])
+
+
+class CaptureWriter(object):
+    """ Append-only segmented capture with a sparse timestamp index """
+
+    def __init__(self, directory: str, name: str = 'capture', marker: bytes = NMEA_MARKER,
+                 index_every: int = 100, segment_size: int = 256 << 20, buffer_size: int = 1 << 20) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.marker = marker
+        self.index_every = index_every
+        self.segment_size = segment_size
+        self.buffer_size = buffer_size
+
+        # continue after the segments of an earlier capture with the same name
+        self.segment = len(glob.glob(os.path.join(directory, glob.escape(name) + '.[0-9][0-9][0-9][0-9].log'))) - 1
+        self._log = self._idx = None
+        self._offset = 0
+        self._countdown = 1  # sentence starts left until the next index record
+
+        # statistics
+        self.bytes = 0
+        self.sentences = 0
+
+        self._rotate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data, timestamp_ns: int = None) -> None:
+        """ Append a received bytes/bytearray chunk, timestamp defaults to its arrival time """
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        if self._offset >= self.segment_size:
+            self._rotate()
+
+        count = data.count(self.marker)
+        self.sentences += count
+        if count >= self._countdown:
+            self._index(data, timestamp_ns)
+        else:
+            self._countdown -= count
+
+        self._log.write(data)
+        self._offset += len(data)
+        self.bytes += len(data)
+
+    def flush(self) -> None:
+        self._log.flush()
+        self._idx.flush()
+
+    def close(self) -> None:
+        if self._log is not None:
+            self._log.close()
+            self._idx.close()
+            self._log = self._idx = None
+
+    def _index(self, data, timestamp_ns: int) -> None:
+        start, countdown = -1, self._countdown
+        while True:
+            start = data.find(self.marker, start + 1)
+            if start < 0:
+                break
+            countdown -= 1
+            if not countdown:
+                self._idx.write(INDEX_RECORD.pack(timestamp_ns, self._offset + start,
+                                                  sentence_type(data, start, self.marker)))
+                countdown = self.index_every
+        self._countdown = countdown
+
+    def _rotate(self) -> None:
+        self.close()
+        self.segment += 1
+        base = os.path.join(self.directory, "{}.{:04d}".format(self.name, self.segment))
+        self._log = open(base + '.log', 'ab', buffering=self.buffer_size)
+        self._idx = open(base + '.idx', 'ab', buffering=self.buffer_size)
+        self._offset = self._log.tell()
+        if self._idx.tell() == 0:
+            self._idx.write(INDEX_HEADER.pack(INDEX_MAGIC, time.time_ns(), time.monotonic_ns()))
+        self._countdown = 1  # every segment starts with an index record
+
+
+class _IndexColumn(object):
+    """ Timestamps of a memory-mapped index as a sequence for bisect """
+
+    def __init__(self, data) -> None:
+        self._data = data
+        self._count = (len(data) - INDEX_HEADER.size) // INDEX_RECORD.size
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> int:
+        return INDEX_RECORD.unpack_from(self._data, INDEX_HEADER.size + i * INDEX_RECORD.size)[0]
+
+    def record(self, i: int) -> tuple:
+        return INDEX_RECORD.unpack_from(self._data, INDEX_HEADER.size + i * INDEX_RECORD.size)
+
+    def close(self) -> None:
+        self._data.close()
+
+
+class CaptureReader(object):
+    """ Seeks in a capture written by CaptureWriter """
+
+    def __init__(self, directory: str, name: str = 'capture') -> None:
+        self.directory = directory
+        self.name = name
+        self.segments = []  # (log path, index column, first timestamp)
+        for path in sorted(glob.glob(os.path.join(directory, glob.escape(name) + '.[0-9][0-9][0-9][0-9].idx'))):
+            with open(path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b''
+            if len(data) < INDEX_HEADER.size or data[:8] != INDEX_MAGIC:
+                continue
+            column = _IndexColumn(data)
+            if len(column):
+                self.segments.append((path[:-4] + '.log', column, column[0]))
+        self._starts = [first for _, _, first in self.segments]
+
+    def seek(self, timestamp_ns: int) -> tuple:
+        """ (log path, offset, record timestamp) of the last index record at or before timestamp_ns """
+        if not self.segments:
+            raise ValueError("empty capture")
+        segment = max(bisect.bisect_right(self._starts, timestamp_ns) - 1, 0)
+        path, column, _ = self.segments[segment]
+        i = max(bisect.bisect_right(column, timestamp_ns) - 1, 0)
+        recorded, offset, _ = column.record(i)
+        return path, offset, recorded
+
+    def logs(self) -> list:
+        return [path for path, _, _ in self.segments]
+
+    def close(self) -> None:
+        for _, column, _ in self.segments:
+            column.close()
+        self.segments, self._starts = [], []
+
+
+class Recorder(object):
+    """ Reads one port in a background thread into a CaptureWriter """
+
+    def __init__(self, settings: dict, writer: CaptureWriter, chunk_size: int = 1 << 16) -> None:
+        self.settings = settings
+        self.writer = writer
+        self._buffer = bytearray(chunk_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self.errors = 0
+
+    @property
+    def stats(self) -> dict:
+        return {'bytes': self.writer.bytes, 'sentences': self.writer.sentences, 'errors': self.errors}
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='recorder', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 1.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.writer.close()
+
+    def _run(self) -> None:
+        view = memoryview(self._buffer)
+        port = None  # pooled handle, leased for the whole session
+        try:
+            while not self._stop.is_set():
+                try:
+                    if port is None:
+                        port = ioserial.pool.acquire(self.settings)
+                    want = max(1, min(port.in_waiting, len(view)))
+                    count = port.readinto(view[:want]) or 0
+                except OSError as e:
+                    self.errors += 1
+                    logger.warning("receive failed: %s", e)
+                    if port is not None:
+                        ioserial.pool.invalidate(self.settings)
+                        port = None
+                    self._stop.wait(0.5)
+                    continue
+                if count:
+                    self.writer.write(self._buffer[:count])
+        finally:
+            if port is not None:
+                ioserial.pool.release(self.settings)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+""" Time-accurate replay of recorded captures.
+
+A capture written by recorder.CaptureWriter is turned into spans between its
+index records. Sentences inside a span are sent at times interpolated by their
+byte position between the two recorded timestamps. A plain log without an
+index (raw NMEA text or HMR binary) is replayed at a fixed byte rate.
+
+Deadlines are absolute on the monotonic clock, so they do not drift; if the
+line falls more than `max_lag` behind, the schedule is rebased instead of
+bursting the backlog. Logs are read in large blocks into one reusable buffer.
+
+    python replay.py --port /dev/ttyUSB0 --speed 10 --loop captures compass-20261018-120000
+"""
+
+import argparse
+import bisect
+import logging
+import os
+import threading
+import time
+
+import ioserial
+from recorder import CaptureReader, NMEA_MARKER, HMR_MARKER
+
+logger = logging.getLogger(__name__)
+
+MIN_SPEED = 0.5
+MAX_SPEED = 100.0
+
+
+def capture_spans(reader: CaptureReader) -> list:
+    """ (log path, start offset, end offset, start ns, end ns) between index records """
+    spans = []
+    for path, column, _ in reader.segments:
+        records = [column.record(i)[:2] for i in range(len(column))]
+        records.append((None, os.path.getsize(path)))
+        for (start_ns, start), (end_ns, end) in zip(records, records[1:]):
+            if end_ns is None:
+                # tail of the segment, keep the byte rate of the previous span
+                if spans and spans[-1][0] == path and spans[-1][2] > spans[-1][1]:
+                    _, a, b, t0, t1 = spans[-1]
+                    end_ns = start_ns + (t1 - t0) * (end - start) // (b - a)
+                else:
+                    end_ns = start_ns
+            spans.append((path, start, end, start_ns, end_ns))
+    return spans
+
+
+def file_spans(path: str, bytes_per_second: float) -> list:
+    """ A plain log without timestamps, replayed at a constant byte rate """
+    size = os.path.getsize(path)
+    return [(path, 0, size, 0, int(size * 1e9 / bytes_per_second))]
+
+
+class Replayer(object):
+    """ Sends recorded spans through a driver with the original timing """
+
+    def __init__(self, driver, spans: list, marker: bytes = NMEA_MARKER, speed: float = 1.0,
+                 loop: bool = False, block_size: int = 1 << 20, max_lag: float = 1.0) -> None:
+        if not spans:
+            raise ValueError("nothing to replay")
+        self.driver = driver
+        self.spans = spans
+        self.marker = marker
+        self.speed = speed
+        self.loop = loop
+        self.max_lag_ns = int(max_lag * 1e9)
+        self._buffer = bytearray(block_size)
+        self._starts = [span[3] for span in spans]
+        self._seek = None
+        self._origin = (0, 0)  # (monotonic ns, recorded ns) that map onto each other
+        self._stop = threading.Event()
+        self._thread = None
+
+        # statistics
+        self.sentences = 0
+        self.bytes = 0
+        self.dropped = 0  # sentences the driver did not take whole
+        self.rebased = 0
+        self.position_ns = spans[0][3]
+
+    @property
+    def speed(self) -> float:
+        return self._speed
+
+    @speed.setter
+    def speed(self, value: float) -> None:
+        if not MIN_SPEED <= value <= MAX_SPEED:
+            raise ValueError("speed must be within {}..{}".format(MIN_SPEED, MAX_SPEED))
+        self._speed = value
+
+    def seek(self, timestamp_ns: int) -> None:
+        """ Continue from the recorded moment timestamp_ns, taken up before the next sentence """
+        self._seek = timestamp_ns
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name='replay', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 1.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run(self) -> None:
+        """ Replay in the calling thread until the end (or stop when looping) """
+        self._seek = self._seek if self._seek is not None else self.spans[0][3]
+        while not self._stop.is_set():
+            target, self._seek = self._seek, None
+            index = max(bisect.bisect_right(self._starts, target) - 1, 0)
+            self._origin = (time.monotonic_ns(), target)
+            if self._play_from(index, target) and self.loop:
+                self._seek = self.spans[0][3]
+            elif self._seek is None:
+                break
+
+    def _play_from(self, index: int, target: int) -> bool:
+        """ Play spans from index on, False if interrupted by seek or stop """
+        handle, handle_path = None, None
+        try:
+            for path, start, end, start_ns, end_ns in self.spans[index:]:
+                if path != handle_path:
+                    if handle:
+                        handle.close()
+                    handle, handle_path = open(path, 'rb', buffering=0), path
+                if not self._play_span(handle, start, end, start_ns, end_ns, target):
+                    return False
+            return True
+        finally:
+            if handle:
+                handle.close()
+
+    def _play_span(self, handle, start: int, end: int, start_ns: int, end_ns: int, target: int) -> bool:
+        view = memoryview(self._buffer)
+        rate = (end_ns - start_ns) / (end - start) if end > start else 0.0  # ns per byte
+        handle.seek(start)
+        base, pending = start, 0  # log offset of the buffer, bytes carried over from the previous block
+        while True:
+            count = handle.readinto(view[pending:min(len(view), end - base)]) or 0
+            filled = pending + count
+            final = not count or base + filled >= end
+            pos = 0
+            while pos < filled:
+                nxt = self._buffer.find(self.marker, pos + 1, filled)
+                if nxt < 0:
+                    if pos and not final:
+                        break  # sentence continues in the next block
+                    nxt = filled
+                when = start_ns + int((base + pos - start) * rate)
+                if when >= target:
+                    if not self._wait(when):
+                        return False
+                    written = self._send(view[pos:nxt])
+                    self.bytes += written
+                    if written == nxt - pos:
+                        self.sentences += 1
+                    else:
+                        self.dropped += 1
+                    self.position_ns = when
+                pos = nxt
+            if final:
+                return True
+            # carry the unfinished tail to the front of the buffer
+            pending = filled - pos
+            self._buffer[:pending] = self._buffer[pos:filled]
+            base += pos
+
+    def _send(self, sentence: memoryview) -> int:
+        """ Bytes written, continuing after short writes until the driver takes none """
+        pos = 0
+        while pos < len(sentence):
+            written = self.driver.send(sentence[pos:]) or 0
+            if not written:
+                break
+            pos += written
+        return pos
+
+    def _wait(self, recorded_ns: int) -> bool:
+        started, origin = self._origin
+        deadline = started + int((recorded_ns - origin) / self._speed)
+        delay = deadline - time.monotonic_ns()
+        if delay < -self.max_lag_ns:
+            # the line cannot keep up, rebase instead of bursting the backlog
+            self._origin = (time.monotonic_ns(), recorded_ns)
+            self.rebased += 1
+        elif delay > 0:
+            self._stop.wait(delay / 1e9)
+        return not self._stop.is_set() and self._seek is None
+
+
+def main(argv=None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)-5.5s]  %(message)s")
+    parser = argparse.ArgumentParser(description="Replay a recorded capture")
+    parser.add_argument('--port', required=True)
+    parser.add_argument('--baudrate', type=int, default=4800)
+    parser.add_argument('--speed', type=float, default=1.0)
+    parser.add_argument('--loop', action='store_true')
+    parser.add_argument('--hmr', action='store_true', help="HMR binary frames instead of NMEA text")
+    parser.add_argument('--seek', type=float, default=0.0, help="start this many seconds into the capture")
+    parser.add_argument('path', help="capture directory, or a plain log file")
+    parser.add_argument('name', nargs='?', default='capture', help="capture name")
+    args = parser.parse_args(argv)
+
+    settings = {'port': args.port, 'baudrate': args.baudrate}
+    if os.path.isdir(args.path):
+        reader = CaptureReader(args.path, args.name)
+        spans = capture_spans(reader)
+        reader.close()
+    else:
+        spans = file_spans(args.path, ioserial.line_capacity(settings))
+
+    driver = ioserial.NmeaDriver()
+    driver.open(settings)
+    replayer = Replayer(driver, spans, HMR_MARKER if args.hmr else NMEA_MARKER, args.speed, args.loop)
+    replayer.seek(spans[0][3] + int(args.seek * 1e9))
+    try:
+        replayer.run()
+        logger.info("sent %d sentences, %d bytes, dropped %d", replayer.sentences, replayer.bytes, replayer.dropped)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        driver.close()
+        ioserial.pool.close_all()
+
+
+if __name__ == '__main__':
+    main()
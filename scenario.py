@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+""" Pre-rendered scenario files.
+
+Layout (little-endian):
+
+    header   magic, version, frame count, index offset, payload offset
+    payload  ready-to-send frames back to back
+    index    N int64 timestamps (ns from scenario start), N + 1 int64 payload offsets
+
+Playback memory-maps the file and writes memoryview slices of the payload, so
+even a multi-gigabyte scenario starts at once and uses constant memory.
+
+    python scenario.py --port /dev/ttyUSB0 --baudrate 4800 --speed 2 --loop soak.scn
+"""
+
+import argparse
+import array
+import bisect
+import logging
+import mmap
+import struct
+import threading
+import time
+
+import ioserial
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'NMEASCN\0'
+VERSION = 1
+HEADER = struct.Struct('<8sIQQQ')
+
+
+class ScenarioWriter(object):
+    """ Appends frames with their timestamps, the index is written on close """
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, 'wb')
+        self._file.write(bytes(HEADER.size))
+        self._timestamps = array.array('q')
+        self._offsets = array.array('q', [HEADER.size])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, timestamp_ns: int, frame) -> None:
+        self._file.write(frame)
+        self._timestamps.append(timestamp_ns)
+        self._offsets.append(self._offsets[-1] + len(frame))
+
+    def add_batch(self, timestamps_ns, blob, offsets) -> None:
+        """ Add frames rendered by batch.encode_nmea/encode_hmr with their N + 1 offsets """
+        base = self._offsets[-1] - offsets[0]
+        self._file.write(memoryview(blob)[offsets[0]:offsets[-1]])
+        self._timestamps.extend(int(ts) for ts in timestamps_ns)
+        self._offsets.extend(base + int(offset) for offset in offsets[1:])
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        index_offset = self._offsets[-1]
+        self._file.write(self._timestamps.tobytes())
+        self._file.write(self._offsets.tobytes())
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, len(self._timestamps), index_offset, HEADER.size))
+        self._file.close()
+
+
+class Scenario(object):
+    """ Memory-mapped read-only scenario """
+
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, index_offset, payload_offset = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError("{} is not a scenario file".format(path))
+
+        self._view = memoryview(self._mmap)
+        self.timestamps = self._view[index_offset:index_offset + 8 * count].cast('q')
+        self.offsets = self._view[index_offset + 8 * count:index_offset + 8 * (2 * count + 1)].cast('q')
+
+        # statistics of the last play
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __getitem__(self, i: int) -> memoryview:
+        return self._view[self.offsets[i]:self.offsets[i + 1]]
+
+    @property
+    def duration_ns(self) -> int:
+        return self.timestamps[-1] - self.timestamps[0] if len(self) else 0
+
+    def frames(self, start: int, stop: int) -> memoryview:
+        """ Frames start..stop-1 as one contiguous slice """
+        return self._view[self.offsets[start]:self.offsets[stop]]
+
+    def find(self, timestamp_ns: int) -> int:
+        """ Index of the first frame at or after timestamp_ns """
+        return bisect.bisect_left(self.timestamps, timestamp_ns)
+
+    def close(self) -> None:
+        for view in (self.timestamps, self.offsets, self._view):
+            view.release()
+        self._mmap.close()
+
+    def play(self, driver, speed: float = 1.0, loop: bool = False, stop: threading.Event = None,
+             max_batch: int = 0) -> int:
+        """ Send frames through driver on their timestamps, return frames written.
+
+        Frames due at a wake-up go out as one slice per write, at most `max_batch`
+        bytes (0 is unlimited) so a write fits in the driver's write timeout.
+        Frames a driver dropped (send returned 0) are counted in `dropped`.
+        """
+        stop = stop or threading.Event()
+        sent = self.dropped = 0
+        if not len(self):
+            return sent
+        while not stop.is_set():
+            started = time.monotonic_ns()
+            origin = self.timestamps[0]
+            i = 0
+            while i < len(self) and not stop.is_set():
+                delay = (self.timestamps[i] - origin) / speed - (time.monotonic_ns() - started)
+                if delay > 0:
+                    stop.wait(delay / 1e9)
+                    continue
+                due = self.find(origin + int((time.monotonic_ns() - started) * speed) + 1)
+                if max_batch:
+                    # at least one frame, even if it alone is larger than max_batch
+                    due = max(i + 1, min(due, bisect.bisect_right(self.offsets, self.offsets[i] + max_batch, i) - 1))
+                written = self._write(driver, i, due)
+                sent += written
+                self.dropped += due - i - written
+                i = due
+            if not loop:
+                break
+        return sent
+
+    def _write(self, driver, start: int, stop: int) -> int:
+        """ Write frames start..stop-1, continuing after short writes; return complete frames written """
+        pos, end = self.offsets[start], self.offsets[stop]
+        while pos < end:
+            written = driver.send(self._view[pos:end]) or 0
+            if not written:
+                break
+            pos += written
+        return bisect.bisect_right(self.offsets, pos, start, stop + 1) - 1 - start
+
+
+def main(argv=None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)-5.5s]  %(message)s")
+    parser = argparse.ArgumentParser(description="Play a pre-rendered scenario")
+    parser.add_argument('--port', required=True)
+    parser.add_argument('--baudrate', type=int, default=4800)
+    parser.add_argument('--speed', type=float, default=1.0)
+    parser.add_argument('--loop', action='store_true')
+    parser.add_argument('path')
+    args = parser.parse_args(argv)
+
+    scenario = Scenario(args.path)
+    settings = {'port': args.port, 'baudrate': args.baudrate}
+    driver = ioserial.NmeaDriver()
+    driver.open(settings)
+    logger.info("%d frames, %.1f s", len(scenario), scenario.duration_ns / 1e9)
+    # what the line carries within the pool's write timeout
+    max_batch = max(int(ioserial.line_capacity(settings) * ioserial.pool.write_timeout), 1)
+    try:
+        sent = scenario.play(driver, args.speed, args.loop, max_batch=max_batch)
+        logger.info("sent %d frames, dropped %d", sent, scenario.dropped)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        driver.close()
+        ioserial.pool.close_all()
+        scenario.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+""" Multi-stream transmit scheduler.
+
+Several (message type, rate, parameters) streams share one line. Deadlines are
+kept in a heap ordered by (deadline, priority), the first deadlines of the streams
+are staggered over their periods, and no frame is released before the previous
+one has left the wire, so streams interleave instead of bursting.
+
+A stream that falls behind (slow line, stalled thread) either skips the frames
+it missed (SKIP) or sends up to `max_catch_up` of them back-to-back so the
+long-run frame count stays exact (CATCH_UP).
+"""
+
+import heapq
+import itertools
+import logging
+
+from metrics import Histogram, registry
+
+logger = logging.getLogger(__name__)
+
+SKIP = 'skip'
+CATCH_UP = 'catch-up'
+POLICIES = (SKIP, CATCH_UP)
+
+_missed = registry.counter('frames_missed_total', "frames skipped because their stream fell behind")
+
+
+class Stream(object):
+    """ One periodic message stream """
+
+    def __init__(self, name: str, encoder, rate: float, params: dict, priority: int = 0) -> None:
+        if rate <= 0:
+            raise ValueError("stream rate must be positive")
+        self.name = name
+        self.encoder = encoder
+        self.rate = rate
+        self.interval_ns = int(1e9 / rate)
+        self.params = dict(params)
+        self.priority = priority
+        self.deadline = 0
+
+        # statistics
+        self.sent = 0
+        self.missed = 0
+        self.errors = 0  # frames that failed to encode
+        self.jitter = Histogram(name)  # ns a frame left after its nominal deadline
+
+    def __repr__(self):
+        return "{}({}, {} Hz)".format(self.__class__.__name__, self.name, self.rate)
+
+    def encode(self) -> bytes:
+        return self.encoder.encode(self.params)
+
+    @property
+    def frame_size(self) -> int:
+        """ Bytes per frame, 0 while the parameters do not encode (nothing is sent) """
+        try:
+            return len(self.encode())
+        except Exception:
+            return 0
+
+
+class StreamScheduler(object):
+    """ Interleaves streams on one line of `capacity` bytes per second """
+
+    def __init__(self, capacity: float, policy: str = SKIP, max_catch_up: int = 10) -> None:
+        if policy not in POLICIES:
+            raise ValueError("unknown policy: {}".format(policy))
+        self.capacity = capacity
+        self.policy = policy
+        self.max_catch_up = max_catch_up
+        self.streams = {}
+        self._heap = []
+        self._order = itertools.count()
+        self._line_free = 0
+
+    def add(self, stream: Stream) -> Stream:
+        self.streams[stream.name] = stream
+        if self.overloaded:
+            logger.warning("streams need %.0f%% of the line capacity", self.load() * 100)
+        return stream
+
+    def remove(self, name: str) -> None:
+        self.streams.pop(name)
+        self._heap = [item for item in self._heap if item[3].name != name]
+        heapq.heapify(self._heap)
+
+    def update(self, name: str, params: dict) -> None:
+        self.streams[name].params = dict(params)
+
+    def load(self) -> float:
+        """ Part of the line capacity the streams need, above 1.0 they do not fit """
+        demand = sum(stream.rate * stream.frame_size for stream in self.streams.values())
+        return demand / self.capacity
+
+    @property
+    def overloaded(self) -> bool:
+        return self.load() > 1.0
+
+    def start(self, now_ns: int) -> None:
+        """ Spread first deadlines, stream i of n starts i/n into its period """
+        self._heap = []
+        self._line_free = now_ns
+        count = len(self.streams)
+        for i, stream in enumerate(self.streams.values()):
+            stream.deadline = now_ns + stream.interval_ns * i // count
+            self._push(stream)
+
+    def next_due(self) -> tuple:
+        """ (release time, stream) of the next frame, the stream stays scheduled """
+        if not self._heap:
+            return None, None
+        deadline, _, _, stream = self._heap[0]
+        return max(deadline, self._line_free), stream
+
+    def sent(self, stream: Stream, size: int, now_ns: int) -> None:
+        """ Account a frame of `size` bytes written at now_ns and reschedule its stream """
+        heapq.heappop(self._heap)
+        self._line_free = max(now_ns, self._line_free) + int(size * 1e9 / self.capacity)
+        stream.sent += 1
+        self._advance(stream, now_ns)
+
+    def failed(self, stream: Stream, now_ns: int) -> None:
+        """ Account a frame that could not be encoded and reschedule its stream """
+        heapq.heappop(self._heap)
+        stream.errors += 1
+        self._advance(stream, now_ns)
+
+    def _advance(self, stream: Stream, now_ns: int) -> None:
+        stream.deadline += stream.interval_ns
+        if stream.deadline < now_ns:
+            behind = (now_ns - stream.deadline) // stream.interval_ns + 1
+            missed = behind - (self.max_catch_up if self.policy == CATCH_UP else 0)
+            if missed > 0:
+                stream.missed += missed
+                _missed.inc(missed)
+                stream.deadline += missed * stream.interval_ns
+        self._push(stream)
+
+    def _push(self, stream: Stream) -> None:
+        heapq.heappush(self._heap, (stream.deadline, stream.priority, next(self._order), stream))
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+""" Supervisor for large multi-port rigs.
+
+Ports are split into groups and every group is driven by a worker process
+(scheduler + fan-out + transmit engine). The supervisor stays a thin controller:
+
+* parameters go to the workers as one snapshot in shared memory, guarded by a
+  sequence counter (seqlock), so workers only parse it after a change;
+* every worker reports its per-port counters back through its own
+  single-producer/single-consumer ring in shared memory, without locks.
+
+    python supervisor.py --per-worker 8 --port /dev/ttyUSB0 ... --port /dev/ttyUSB31 --stream compass:10
+
+The CLI is the controller: `type.key=value` lines on stdin (compass.heading=90)
+change parameters of the running workers through `update`, counters are read
+with `poll`. The GUI configures a single port and keeps its in-process
+TransmitEngine.
+"""
+
+import json
+import logging
+import multiprocessing
+import struct
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+import ioserial
+from engine import TransmitEngine, apply_param, build_parser, port_settings, stream_params
+from fanout import FanOut
+from protocols import compile_encoder
+from scheduler import SKIP, Stream, StreamScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class SharedParams(object):
+    """ Parameter snapshot {type: params} in shared memory behind a seqlock """
+    HEADER = struct.Struct('<QI')  # sequence (odd while writing), payload length
+
+    def __init__(self, name: str = None, size: int = 1 << 16) -> None:
+        self._shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self._shm.name
+        self._owner = name is None
+        if self._owner:
+            self.HEADER.pack_into(self._shm.buf, 0, 0, 0)
+
+    def publish(self, snapshot: dict) -> None:
+        payload = json.dumps(snapshot).encode()
+        if self.HEADER.size + len(payload) > self._shm.size:
+            raise ValueError("parameter snapshot does not fit in shared memory")
+        buf = self._shm.buf
+        sequence, _ = self.HEADER.unpack_from(buf)
+        self.HEADER.pack_into(buf, 0, sequence + 1, len(payload))
+        buf[self.HEADER.size:self.HEADER.size + len(payload)] = payload
+        self.HEADER.pack_into(buf, 0, sequence + 2, len(payload))
+
+    def read(self, last_sequence: int = -1) -> tuple:
+        """ (sequence, snapshot), snapshot is None when nothing changed since last_sequence """
+        buf = self._shm.buf
+        while True:
+            sequence, length = self.HEADER.unpack_from(buf)
+            if sequence == last_sequence:
+                return sequence, None
+            if sequence & 1:
+                time.sleep(0)  # writer in progress
+                continue
+            payload = bytes(buf[self.HEADER.size:self.HEADER.size + length])
+            if self.HEADER.unpack_from(buf)[0] == sequence:
+                return sequence, json.loads(payload) if length else None
+
+    def close(self) -> None:
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class CounterRing(object):
+    """ Single-producer/single-consumer ring of counter records in shared memory.
+
+    The producer only writes `head` and the consumer only writes `tail`, both
+    aligned 8-byte words, so no lock is needed between the two processes.
+    """
+    HEADER = struct.Struct('<QQ')  # head, tail
+    RECORD = struct.Struct('<Iqqqq')  # port index, frames, bytes, dropped, errors
+
+    def __init__(self, name: str = None, capacity: int = 1024) -> None:
+        size = self.HEADER.size + capacity * self.RECORD.size
+        self._shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self._shm.name
+        self.capacity = (self._shm.size - self.HEADER.size) // self.RECORD.size
+        self._owner = name is None
+        if self._owner:
+            self.HEADER.pack_into(self._shm.buf, 0, 0, 0)
+
+    def push(self, *record) -> bool:
+        buf = self._shm.buf
+        head, tail = self.HEADER.unpack_from(buf)
+        if head - tail >= self.capacity:
+            return False
+        self.RECORD.pack_into(buf, self.HEADER.size + (head % self.capacity) * self.RECORD.size, *record)
+        struct.pack_into('<Q', buf, 0, head + 1)
+        return True
+
+    def pop_all(self) -> list:
+        buf = self._shm.buf
+        head, tail = self.HEADER.unpack_from(buf)
+        records = [self.RECORD.unpack_from(buf, self.HEADER.size + (i % self.capacity) * self.RECORD.size)
+                   for i in range(tail, head)]
+        struct.pack_into('<Q', buf, 8, head)
+        return records
+
+    def close(self) -> None:
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _worker(first: int, ports: list, streams: list, params_name: str, ring_name: str, stop,
+            report: float, lag: str) -> None:
+    """ Worker process: drives one group of ports """
+    shared = SharedParams(params_name)
+    ring = CounterRing(ring_name)
+
+    sequence, params = shared.read()
+    scheduler = StreamScheduler(ioserial.line_capacity(min(ports, key=ioserial.line_capacity)), lag)
+    for name, rate in streams:
+        encoder = compile_encoder(name)
+        rate = rate or scheduler.capacity / len(encoder.encode(params[name]))
+        scheduler.add(Stream(name, encoder, rate, params[name]))
+
+    fanout = FanOut(ports)
+    fanout.start()
+    engine = TransmitEngine(fanout, scheduler)
+    engine.start()
+
+    reported = time.monotonic()
+    try:
+        while not stop.wait(0.1):
+            sequence, snapshot = shared.read(sequence)
+            if snapshot:
+                for name in scheduler.streams:
+                    engine.update(name, snapshot[name])
+
+            if time.monotonic() - reported >= report:
+                reported = time.monotonic()
+                for i, sink in enumerate(fanout.sinks):
+                    ring.push(first + i, sink.frames, sink.bytes, sink.dropped, sink.errors)
+    finally:
+        engine.stop()
+        fanout.stop()
+        ioserial.pool.close_all()
+        shared.close()
+        ring.close()
+
+
+class Supervisor(object):
+    """ Runs groups of `per_worker` ports in worker processes """
+
+    def __init__(self, ports: list, streams: list, params: dict, per_worker: int = 8,
+                 report: float = 0.5, lag: str = SKIP) -> None:
+        self.ports = ports
+        self.lag = lag
+        self.streams = streams
+        self.per_worker = per_worker
+        self.report = report
+        self._params = {name: dict(values) for name, values in params.items()}
+        self._context = multiprocessing.get_context('spawn')
+        self._stop = None
+        self._shared = None
+        self._workers = []  # (process, ring)
+        self._counters = {}
+
+    def start(self) -> None:
+        self._shared = SharedParams()
+        self._shared.publish(self._params)
+        self._stop = self._context.Event()
+        for first in range(0, len(self.ports), self.per_worker):
+            ring = CounterRing()
+            process = self._context.Process(
+                target=_worker, name='worker-{}'.format(first // self.per_worker), daemon=True,
+                args=(first, self.ports[first:first + self.per_worker], self.streams,
+                      self._shared.name, ring.name, self._stop, self.report, self.lag))
+            process.start()
+            self._workers.append((process, ring))
+
+    def update(self, name: str, params) -> None:
+        """ Publish new parameters of a message type to every worker """
+        self._params[name] = dict(params)
+        self._shared.publish(self._params)
+
+    def poll(self) -> dict:
+        """ Latest counters by index into `ports`, the same device may be listed twice """
+        for _, ring in self._workers:
+            for index, frames, size, dropped, errors in ring.pop_all():
+                self._counters[index] = {'port': self.ports[index]['port'], 'frames': frames, 'bytes': size,
+                                         'dropped': dropped, 'errors': errors}
+        return dict(self._counters)
+
+    @property
+    def alive(self) -> int:
+        return sum(process.is_alive() for process, _ in self._workers)
+
+    def stop(self, timeout: float = 2.0) -> None:
+        if self._stop is not None:
+            self._stop.set()
+        for process, ring in self._workers:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+            ring.close()
+        self._workers = []
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
+
+def _read_updates(supervisor: Supervisor, params: dict, lines) -> None:
+    """ Apply `type.key=value` lines to the running workers """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            name = apply_param(params, line)
+        except ValueError as e:
+            logger.warning("%s", e)
+            continue
+        supervisor.update(name, params[name])
+        logger.info("%s updated: %s", name, params[name])
+
+
+def main(argv=None) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(processName)-10.10s] [%(levelname)-5.5s]  %(message)s")
+    parser = build_parser()
+    parser.description = "Headless generator for many ports, sharded over worker processes"
+    parser.add_argument('--per-worker', type=int, default=8, help="ports per worker process")
+    args = parser.parse_args(argv)
+    try:
+        streams, params = stream_params(args)
+    except ValueError as e:
+        parser.error(str(e))
+    supervisor = Supervisor(port_settings(args), streams, params, args.per_worker, lag=args.lag)
+    supervisor.start()
+    threading.Thread(target=_read_updates, args=(supervisor, params, sys.stdin), name='updates', daemon=True).start()
+    started = time.monotonic()
+    try:
+        while not args.duration or time.monotonic() - started < args.duration:
+            time.sleep(1.0)
+            counters = supervisor.poll()
+            logger.info("workers %d, frames %d, bytes %d, dropped %d, errors %d", supervisor.alive,
+                        sum(c['frames'] for c in counters.values()),
+                        sum(c['bytes'] for c in counters.values()),
+                        sum(c['dropped'] for c in counters.values()),
+                        sum(c['errors'] for c in counters.values()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
-from PyQt5.QtCore import Qt, pyqtSignal
+from types import MappingProxyType
+
+from PyQt5.QtCore import Qt, pyqtSignal, QAbstractListModel, QModelIndex, QTimer
 from PyQt5.QtWidgets import *
 from PyQt5.QtWidgets import QWidget
 
@@ -15,6 +17,9 @@ class Option(QWidget):
 
         self._createUi()
 
+    def currentIndex(self) -> int:
+        return self._combo.currentIndex()
+
     def _createUi(self):
         cb = QComboBox()
         cb.setFixedWidth(120)
@@ -25,16 +30,27 @@ class Option(QWidget):
         layout.addWidget(QLabel(f"{self.name}:"))
         layout.addWidget(cb)
 
+        self._combo = cb
+
         # Connect signal/slot
         cb.currentIndexChanged['int'].connect(self.currentIndexChanged)
 
 
 class OptionBox(QWidget):
+    """ Message parameters editor.
+
+    Keeps an immutable snapshot of the parameters that is replaced only when a
+    widget value changes, so it can be read without touching Qt (and from
+    another thread).
+    """
+    paramsChanged = pyqtSignal(object)
+
     def __init__(self, fields: (list, tuple), parent=None):
         super().__init__(parent)
 
         self._fields = fields
         self._createUi()
+        self.update_params()
 
     def _createUi(self):
         self.setLayout(QGridLayout(self))
@@ -54,6 +70,11 @@ class OptionBox(QWidget):
             w.setObjectName(key)
             w.setFixedWidth(60)
 
+            if isinstance(w, QComboBox):
+                w.currentTextChanged['QString'].connect(lambda value, key=key: self._on_changed(key, value))
+            else:
+                w.valueChanged.connect(lambda value, key=key: self._on_changed(key, value))
+
             self.layout().addWidget(QLabel(f"{name.capitalize()}:"), row, 0)
             self.layout().addWidget(w, row, 1)
             
@@ -80,35 +101,105 @@ class OptionBox(QWidget):
         w.addItems(items)
         return w
 
+    def _on_changed(self, key: str, value) -> None:
+        params = dict(self.params)
+        params[key] = value
+        self.params = MappingProxyType(params)
+        self.paramsChanged.emit(self.params)
+
     def update_params(self):
-        self.params = {} 
+        """ Rebuild the snapshot from the widgets """
+        params = {}
         for child in self.children():
             if hasattr(child, "currentText"):
-                self.params[child.objectName()] = child.currentText()
+                params[child.objectName()] = child.currentText()
             elif hasattr(child, "value"):
-                self.params[child.objectName()] = child.value()
+                params[child.objectName()] = child.value()
+        self.params = MappingProxyType(params)
 
     def get_param(self):
-        self.update_params()
         return self.params
 
 
+class RingBufferModel(QAbstractListModel):
+    """ List model keeping only the last `capacity` rows.
+
+    Appended rows are queued and flushed at most every `flush_ms`, one
+    rowsRemoved/rowsInserted pair per flush however many rows arrived.
+    """
+
+    def __init__(self, capacity: int = 1000, flush_ms: int = 33, parent=None) -> None:
+        super().__init__(parent)
+        self._capacity = capacity
+        self._rows = [None] * capacity
+        self._head = 0
+        self._count = 0
+        self._pending = []
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(flush_ms)
+        self._timer.timeout.connect(self.flush)
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else self._count
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid() or index.row() >= self._count:
+            return None
+        return self._rows[(self._head + index.row()) % self._capacity]
+
+    def append(self, value: str) -> None:
+        self._pending.append(value)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def clear(self) -> None:
+        self.beginResetModel()
+        self._rows = [None] * self._capacity
+        self._head = self._count = 0
+        self._pending.clear()
+        self.endResetModel()
+
+    def flush(self) -> None:
+        pending = self._pending[-self._capacity:]
+        self._pending.clear()
+        if not pending:
+            return
+
+        overflow = self._count + len(pending) - self._capacity
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            self._head = (self._head + overflow) % self._capacity
+            self._count -= overflow
+            self.endRemoveRows()
+
+        self.beginInsertRows(QModelIndex(), self._count, self._count + len(pending) - 1)
+        for value in pending:
+            self._rows[(self._head + self._count) % self._capacity] = value
+            self._count += 1
+        self.endInsertRows()
+
+
 class Terminal(QWidget):
-    def __init__(self, parent: QWidget | None ) -> None:
+    def __init__(self, parent: QWidget | None, capacity: int = 1000) -> None:
         super().__init__(parent)
+        self.model = RingBufferModel(capacity, parent=self)
         self._createUi()
 
     def append(self, value: str):
-        print(f"append {value}")
+        self.model.append(value)
 
     def clear(self):
-        print(f"on clear")
+        self.model.clear()
 
     def _createUi(self):
         self.listview = QListView()
+        self.listview.setModel(self.model)
+        self.listview.setUniformItemSizes(True)
         self.listview.setEditTriggers(QAbstractItemView.NoEditTriggers)
         self.listview.setSelectionMode(QAbstractItemView.NoSelection)
-        self.listview.setFocusPolicy(QtCore.Qt.NoFocus)
+        self.listview.setFocusPolicy(Qt.NoFocus)
 
         btn = QPushButton('Очистить')
         btn.setFixedWidth(60)
@@ -118,3 +209,6 @@ class Terminal(QWidget):
         layout.setContentsMargins(0,0,0,0)
         layout.addWidget(self.listview)
         layout.addWidget(btn)
+
+        # Connect signal/slot
+        self.model.rowsInserted.connect(self.listview.scrollToBottom)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+""" Virtual serial ports for running without adapters (the pty one is POSIX only).
+
+    pty://loopback  a pseudo-terminal whose far end sends everything back, so
+                    the port behaves like a real one with a loopback plug
+                    (tty, termios and a file descriptor for FanOut/asyncio)
+    loop://         in-process loopback, no tty and no system calls: the
+                    fastest path for benchmarking the transmit and receive
+                    pipelines (pyserial's own loop:// queues byte by byte)
+
+The names available on this system (PORTS) are listed by ioserial.find_ports and
+opened by the serial pool like any other port. PtyPair gives a benchmark direct access to the far end instead.
+"""
+
+import io
+import os
+import select
+import threading
+import time
+
+import serial
+
+PTY = 'pty://loopback'
+LOOP = 'loop://'
+PORTS = (PTY, LOOP) if os.name == 'posix' else (LOOP,)  # no pty module on Windows
+
+
+def is_virtual(port: str) -> bool:
+    return port in PORTS
+
+
+def open_port(port: str, **kwargs) -> serial.Serial:
+    """ Open a virtual port with serial.Serial keyword arguments """
+    if port == LOOP:
+        return LoopbackPort(**kwargs)
+    if port == PTY:
+        return PtyLoopback(port, **kwargs)
+    raise ValueError("unknown virtual port: {}".format(port))
+
+
+class PtyPair(object):
+    """ Pseudo-terminal in raw mode: `name` is the serial side, `master` the far end """
+
+    def __init__(self) -> None:
+        import pty
+        import tty
+
+        self.master, self._slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self._slave)
+        self.name = os.ttyname(self._slave)
+
+    def close(self) -> None:
+        # the slave end stays open until here, or reads on the master fail with EIO
+        for fd in (self.master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.master = self._slave = -1
+
+
+class PtyLoopback(serial.Serial):
+    """ serial.Serial on a pty pair with an echoing far end """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self._pair = None
+        self._echo = None
+        self._running = False
+        super().__init__(*args, **kwargs)
+
+    def open(self) -> None:
+        self._pair = PtyPair()
+        self._port = self.portstr = self._pair.name
+        super().open()
+        self._running = True
+        self._echo = threading.Thread(target=self._run, name='pty-echo', daemon=True)
+        self._echo.start()
+
+    def close(self) -> None:
+        super().close()
+        self._running = False
+        if self._echo is not None:
+            self._echo.join(1.0)
+            self._echo = None
+        if self._pair is not None:
+            self._pair.close()
+            self._pair = None
+
+    def _run(self) -> None:
+        master = self._pair.master
+        os.set_blocking(master, False)
+        while self._running:
+            if not select.select([master], [], [], 0.1)[0]:
+                continue
+            try:
+                data = os.read(master, 1 << 16)
+                while data and self._running:
+                    # wait while the reader of the port is behind, like a line that cannot be overrun
+                    if select.select([], [master], [], 0.1)[1]:
+                        data = data[os.write(master, data):]
+            except BlockingIOError:
+                continue
+            except OSError:
+                return
+
+
+class LoopbackPort(object):
+    """ In-process loopback with the part of the serial.Serial interface the pool and framers use """
+
+    def __init__(self, baudrate: int = 9600, timeout: float = None, buffer_size: int = 1 << 20, **_) -> None:
+        self.port = LOOP
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.buffer_size = buffer_size
+        self.is_open = True
+        self._data = bytearray()
+        self._cond = threading.Condition()
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self._data)
+
+    def write(self, data) -> int:
+        with self._cond:
+            self._check()
+            if len(self._data) + len(data) > self.buffer_size:
+                raise serial.SerialTimeoutException("loopback buffer overrun")
+            self._data += data
+            self._cond.notify_all()
+        return len(data)
+
+    def readinto(self, buffer) -> int:
+        with self._cond:
+            self._check()
+            if not self._data:
+                self._cond.wait_for(lambda: self._data or not self.is_open, self.timeout)
+            count = min(len(buffer), len(self._data))
+            buffer[:count] = self._data[:count]
+            del self._data[:count]
+            return count
+
+    def read(self, size: int = 1) -> bytes:
+        buffer = bytearray(size)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        count = 0
+        while count < size:
+            count += self.readinto(memoryview(buffer)[count:])
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        return bytes(buffer[:count])
+
+    def fileno(self) -> int:
+        raise io.UnsupportedOperation("loop:// has no file descriptor, use pty://loopback")
+
+    def flush(self) -> None:
+        pass
+
+    def reset_input_buffer(self) -> None:
+        with self._cond:
+            self._data.clear()
+
+    def close(self) -> None:
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+    def _check(self) -> None:
+        if not self.is_open:
+            raise serial.PortNotOpenError()